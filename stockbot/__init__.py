@@ -0,0 +1,9 @@
+"""
+Stockbot: tracks Carrier Stock and WMM data for the Pilots Trade Network discord.
+Run it with `python -m stockbot`, see stockbot.main.
+"""
+
+import time
+
+# when the bot process started, the startup metrics are measured from here.
+STARTED = time.monotonic()
@@ -0,0 +1,4 @@
+from stockbot.main import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+cAPI proxy client: carrier market requests batched into one call per batch.
+"""
+
+import asyncio
+
+from stockbot.config import API_HOST, API_TOKEN, CAPI_BATCH_SIZE, MARKET_CACHE_TTL
+from stockbot.logs import upstream_log
+from stockbot.upstream import api_get, api_post, capi_breaker, capi_limiter, oauth_breaker
+from stockbot.util import chunk
+
+
+class CapiError(Exception):
+    # non-200 response from the cAPI proxy, status tells the caller whether to re-auth, retry or give up.
+    def __init__(self, status, data):
+        super().__init__(f"cAPI returned {status}")
+        self.status = status
+        self.data = data
+
+
+class CapiClient:
+    """
+    Client for the PTN cAPI proxy, over the shared keep-alive http session (which also handles gzip).
+    carriers() asks for many carriers in one POST to /capi/batch when the proxy supports it,
+    and falls back to concurrent single requests when it doesn't.
+    All responses are (status, json) or (status, text), as from api_get.
+    """
+    def __init__(self, host, token, batch_size):
+        self.host = host
+        self.token = token
+        self.batch_size = batch_size
+        # None until we know whether the proxy has a batch endpoint.
+        self.batch_supported = None
+        self.pending = {}
+        # prefetch tasks, referenced until done since the event loop only keeps weak references.
+        self.tasks = set()
+
+    async def carrier(self, carrierid, dev=False):
+        pending = self.pending.pop(carrierid, None)
+        if pending is not None and not dev:
+            response = await pending
+            if response is not None:
+                return response
+        return await self.request(carrierid, dev)
+
+    async def request(self, carrierid, dev=False):
+        # a single carrier, straight from the proxy.
+        params = {'token': self.token}
+        if dev:
+            params['dev'] = "true"
+
+        async def request():
+            await capi_limiter.wait()
+            return await api_get(f"{self.host}/capi/{carrierid}", params)
+        return await capi_breaker.call(request, failed=api_unavailable)
+
+    async def generate(self, carrierid, force=False):
+        # start a new oauth for the carrier, the response has the token for the auth url.
+        params = {'token': self.token}
+        if force:
+            params['force'] = "true"
+        return await oauth_breaker.call(lambda: api_get(f"{self.host}/generate/{carrierid}", params), failed=api_unavailable)
+
+    async def carriers(self, carrierids):
+        """
+        Fetch many carriers, in batches of batch_size where the proxy supports it.
+
+        :returns: dict of carrier id to (status, data), as returned by carrier().
+        :rtype: dict
+        """
+        carrierids = list(dict.fromkeys(carrierids))
+        responses = {}
+        if self.batch_supported is not False:
+            for batch in chunk(carrierids, self.batch_size):
+                batch_responses = await self.batch(batch)
+                if batch_responses is None:
+                    break
+                responses.update(batch_responses)
+        # anything the batch didn't answer for, one request per carrier.
+        missing = [carrierid for carrierid in carrierids if carrierid not in responses]
+        responses.update(zip(missing, await asyncio.gather(*[self.request(carrierid) for carrierid in missing])))
+        return responses
+
+    async def batch(self, carrierids):
+        """
+        One request for many carriers: POST /capi/batch with {"carriers": [ids]}, answered with
+        {"carriers": {id: {"status": status, "data": data}}}. Carriers missing from the answer are left out.
+
+        :returns: dict of carrier id to (status, data), or None if the proxy has no batch endpoint or the batch request failed.
+        :rtype: dict
+        """
+        async def request():
+            await capi_limiter.wait()
+            return await api_post(f"{self.host}/capi/batch", {'token': self.token}, {'carriers': carrierids})
+        status, data = await capi_breaker.call(request, failed=api_unavailable)
+        if status in (404, 405):
+            upstream_log.info("cAPI proxy has no batch endpoint, fetching carriers one at a time.")
+            self.batch_supported = False
+            return None
+        self.batch_supported = True
+        if api_unavailable((status, data)):
+            # cAPI maintenance or the proxy is down, the same goes for every carrier in the batch.
+            return {carrierid: (status, data) for carrierid in carrierids}
+        if status != 200 or not isinstance(data, dict) or not isinstance(data.get('carriers'), dict):
+            # a problem with the batch request itself (bad body, proxy auth), not with the carriers in it.
+            upstream_log.warning("cAPI batch request failed with %s, fetching carriers one at a time.", status, extra={'source': 'capi'})
+            return None
+        return {carrierid: (response['status'], response.get('data')) for carrierid, response in data['carriers'].items()
+                if carrierid in carrierids and isinstance(response, dict) and 'status' in response}
+
+    def prefetch(self, carrierids):
+        """
+        Start fetching carriers in a batch in the background. carrier() calls for them wait for the batch,
+        and make their own request if it failed or didn't include them.
+        """
+        carrierids = [carrierid for carrierid in carrierids if carrierid not in self.pending]
+        if not carrierids or self.batch_supported is False:
+            return
+        loop = asyncio.get_running_loop()
+        futures = {carrierid: loop.create_future() for carrierid in carrierids}
+        self.pending.update(futures)
+
+        def prefetched(task):
+            responses = {}
+            if not task.cancelled() and task.exception() is None:
+                responses = task.result()
+            elif not task.cancelled():
+                upstream_log.warning("cAPI batch fetch failed: %s", task.exception(), extra={'source': 'capi'})
+            for carrierid, future in futures.items():
+                if not future.done():
+                    future.set_result(responses.get(carrierid))
+            # responses nobody picked up are as old as a cached market after the cAPI cache TTL, drop them then.
+            loop.call_later(MARKET_CACHE_TTL['capi'], expire)
+
+        def expire():
+            for carrierid, future in futures.items():
+                if self.pending.get(carrierid) is future:
+                    del self.pending[carrierid]
+        task = asyncio.ensure_future(self.carriers(carrierids))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(prefetched)
+
+
+def api_unavailable(response):
+    # 418 is cAPI maintenance, 5xx is the proxy itself. anything else is about the carrier, not the upstream.
+    status, data = response
+    return status == 418 or status >= 500
+
+
+capi_client = CapiClient(API_HOST, API_TOKEN, CAPI_BATCH_SIZE)
+
+
+# function taken from FCMS
+def from_hex(mystr):
+    try:
+        return bytes.fromhex(mystr).decode('utf-8')
+    except TypeError:
+        return "Unregistered Carrier"
+    except ValueError:
+        return "Unregistered Carrier"
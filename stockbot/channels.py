@@ -0,0 +1,194 @@
+"""
+Discord side effects: channel pages, history cleanup and owner DMs.
+"""
+
+import os
+import discord
+import re
+import asyncio
+
+from stockbot.client import bot
+from stockbot.config import DM_RATE, DM_RETRIES, ENV
+from stockbot.logs import log
+from stockbot.metrics import DISCORD_REQUESTS, OWNER_DMS
+from stockbot.store import FCDATA, carrier_index, carrier_store, owner_id, save_carriers
+from stockbot.upstream import RateLimiter
+
+
+class ChannelPages:
+    """
+    Keeps the bot's messages in a channel in step with a list of pages.
+    Pages whose content changed are edited in place, and messages are only sent or deleted
+    when the number of pages changes. The posted message ids and contents are kept in the
+    carrier store so a restart carries on editing the same messages.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.posted = carrier_store.load_messages(channel.id)
+
+    async def render(self, pages):
+        for i, page in enumerate(pages):
+            if i < len(self.posted):
+                message_id, content = self.posted[i]
+                if content == page:
+                    continue
+                try:
+                    DISCORD_REQUESTS.inc(op='edit')
+                    await self.channel.get_partial_message(message_id).edit(content=page)
+                    self.posted[i] = (message_id, page)
+                    continue
+                except discord.NotFound:
+                    # someone deleted our message, repost from here down to keep the pages in order.
+                    await self.delete_from(i)
+            DISCORD_REQUESTS.inc(op='send')
+            message = await self.channel.send(page)
+            self.posted.append((message.id, page))
+        await self.delete_from(len(pages))
+        carrier_store.save_messages(self.channel.id, self.posted)
+
+    async def delete_from(self, index):
+        stale = [self.channel.get_partial_message(message_id) for message_id, content in self.posted[index:]]
+        del self.posted[index:]
+        for message in stale:
+            try:
+                DISCORD_REQUESTS.inc(op='delete')
+                await message.delete()
+            except discord.NotFound:
+                pass
+
+
+async def clear_history(channel, limit=20):
+    try:
+        msgs = []
+        async for message in channel.history(limit=limit):
+            if message.author.name == bot.user.name:
+                msgs.append(message)
+        DISCORD_REQUESTS.inc(op='delete')
+        await channel.delete_messages(msgs)
+    except:
+        # discord doesn't let us delete history after 14 days, nothing we can do.
+        pass
+
+
+async def dm_bot_owner(carrierid, owner, message):
+    try:
+        ownerid = "".join(re.findall(r'\d+',str(owner)))
+        if ENV == 'dev':
+            ownerid = os.getenv('DEVOWNERID', None)
+        ownerdm = bot.get_user(int(ownerid))
+        DISCORD_REQUESTS.inc(op='send')
+        await ownerdm.send(message)
+        return True
+    except Exception as e:
+        # couldnt send a DM, most likely wrong owner supplied or discord perms.
+        log.warning("Could not notify carrier %s owner %s via DM: %s", carrierid, owner, e, extra={'carrier': carrierid})
+        return False
+
+
+class OwnerNotifier:
+    """
+    Collects owner DMs during a wmm update and sends them as one digest per owner when flushed,
+    with the digests spaced out to at most `rate` a second.
+    An alert is queued once per (carrier code, key) until it is delivered. Undelivered alerts stay
+    queued for the next flush, up to `retries` attempts. Delivered alerts with a `notified` commodity
+    are marked in the carrier's data, and those carriers are saved together at the end of the flush.
+    """
+    def __init__(self, rate, retries):
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        # owner id -> {(carrier code, key): alert}
+        self.pending = {}
+        self.task = None
+        self.again = False
+
+    def queue(self, fcid, key, message, notified=None):
+        # owners are keyed by their id, so carriers added with a mention or a plain id share a digest.
+        owner = owner_id(FCDATA[fcid].get('owner'))
+        if owner is None:
+            log.info("Carrier %s has no owner to notify", fcid, extra={'carrier': fcid})
+            return
+        alerts = self.pending.setdefault(owner, {})
+        if (fcid, key) in alerts:
+            return
+        alerts[(fcid, key)] = {'fcid': fcid, 'message': message, 'notified': notified, 'attempts': 0}
+        OWNER_DMS.inc(result='queued')
+
+    def flush_soon(self):
+        # start a flush in the background, or have the running one go round again for anything queued since.
+        if not self.pending:
+            return
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        else:
+            self.again = True
+
+    async def run(self):
+        self.again = True
+        while self.again:
+            self.again = False
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to send owner notifications")
+
+    @staticmethod
+    def digests(alerts):
+        """
+        Split an owner's alerts into DMs under discord's 2000 character limit.
+
+        :returns: list of (message, alert keys in that message)
+        :rtype: list
+        """
+        if not alerts:
+            return []
+        if len(alerts) == 1:
+            key, alert = next(iter(alerts.items()))
+            return [(alert['message'], [key])]
+        messages = []
+        text, keys = "Updates on your Fleet Carriers:", []
+        for key, alert in alerts.items():
+            line = '- ' + alert['message']
+            if keys and len(text) + len(line) + 1 > 2000:
+                messages.append((text, keys))
+                text, keys = "Updates on your Fleet Carriers (continued):", []
+            text += '\n' + line
+            keys.append(key)
+        messages.append((text, keys))
+        return messages
+
+    async def flush(self):
+        notified = set()
+        for owner in list(self.pending):
+            alerts = self.pending[owner]
+            owned = carrier_index.owned_by(owner)
+            for key in [key for key, alert in alerts.items() if alert['fcid'] not in owned]:
+                # carrier deleted or given to another owner since the alert was queued.
+                del alerts[key]
+            for message, keys in self.digests(alerts):
+                await self.limiter.wait()
+                fcid = alerts[keys[0]]['fcid']
+                if await dm_bot_owner(fcid, owner, message):
+                    OWNER_DMS.inc(result='sent')
+                    for key in keys:
+                        alert = alerts.pop(key)
+                        if alert['notified'] and 'wmm' in FCDATA.get(alert['fcid'], {}):
+                            # marked straight away so the alert isn't queued again before the save.
+                            FCDATA[alert['fcid']].setdefault('notified', {})[alert['notified']] = True
+                            notified.add(alert['fcid'])
+                    continue
+                OWNER_DMS.inc(result='failed')
+                for alert in alerts.values():
+                    alert['attempts'] += 1
+                for key in [key for key, alert in alerts.items() if alert['attempts'] >= self.retries]:
+                    log.warning("Giving up on notifying the owner of %s: %s", key[0], alerts.pop(key)['message'], extra={'carrier': key[0]})
+                    OWNER_DMS.inc(result='dropped')
+                # leave the rest of this owner's alerts for the next flush.
+                break
+            if not alerts:
+                del self.pending[owner]
+        notified &= FCDATA.keys()
+        if notified:
+            save_carriers(notified)
+
+
+owner_notifier = OwnerNotifier(DM_RATE, DM_RETRIES)
@@ -0,0 +1,71 @@
+"""
+The discord bot and its command hooks, cogs are loaded as extensions in setup_hook.
+"""
+
+import discord
+import time
+from discord.ext import commands
+
+from stockbot.config import GUILD_ID
+from stockbot.logs import log
+from stockbot.metrics import COMMAND_SECONDS
+from stockbot.upstream import CircuitOpenError
+
+
+COGS = ('stockbot.cogs.carriers', 'stockbot.cogs.wmm', 'stockbot.cogs.history', 'stockbot.cogs.status')
+intents = discord.Intents.default()
+intents.members = True
+intents.message_content = True
+
+
+class StockBot(commands.Bot):
+    async def setup_hook(self):
+        # the commands are loaded once logged in, leaving the imports they need out of the startup path.
+        for extension in COGS:
+            await self.load_extension(extension)
+
+
+bot = StockBot(command_prefix=';', intents=intents)
+guild_obj = discord.Object(id=GUILD_ID)
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started = time.monotonic()
+
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    COMMAND_SECONDS.observe(time.monotonic() - ctx.started, command=ctx.command.qualified_name)
+
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    COMMAND_SECONDS.observe((discord.utils.utcnow() - interaction.created_at).total_seconds(), command=f"/{command.qualified_name}")
+
+
+@bot.event
+async def on_error(event, *args, **kwargs):
+    log.exception("Unhandled exception in %s", event)
+    raise
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    command = ctx.invoked_with
+    log.debug("Command error in %s: %r", command, error)
+    if isinstance(error, commands.errors.CheckFailure):
+        message = "You do not have the correct role for this command."
+    elif isinstance(error, commands.MissingPermissions):
+        message = "You are missing the required permissions to run this command!"
+    elif isinstance(error, commands.MissingRequiredArgument):
+        message = f"Missing a required argument: '{error.param}'. See `;help {command}` for more info."
+    elif isinstance(error, commands.ConversionError):
+        message = str(error)
+    elif isinstance(error, commands.CommandInvokeError) and isinstance(error.original, CircuitOpenError):
+        breaker = error.original.breaker
+        message = f"{breaker.name} is currently unavailable, please try again in {breaker.retry_in():.0f} seconds."
+    else:
+        log.error("Command %s failed", command, exc_info=error)
+        message = "Oh no! Something went wrong while running the command!"
+    await ctx.send(message)
@@ -0,0 +1,3 @@
+"""
+The bot's commands, one discord.py extension per module, loaded by StockBot.setup_hook.
+"""
@@ -0,0 +1,273 @@
+"""
+Carrier commands: adding, removing, listing carriers and ;stock.
+"""
+
+import discord
+import re
+from discord.ext import commands
+from discord import app_commands
+
+from stockbot.capi import capi_client
+from stockbot.channels import dm_bot_owner
+from stockbot.client import guild_obj
+from stockbot.config import API_HOST
+from stockbot.logs import log, upstream_log
+from stockbot.markets import market_cache, market_fingerprints, market_snapshots
+from stockbot.stock import stock_command
+from stockbot.store import FCDATA, carrier_list, delete_carrier, get_fccode, save_carrier
+
+
+class Carriers(commands.Cog):
+    """
+    Adding, removing and listing carriers, their owners and cAPI access, and ;stock.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name='add_FC', help='Add a fleet carrier for stock tracking.\n'
+                                          'FCCode: Carrier ID Code \n'
+                                          'FCName: The alias with which you want to refer to the carrier. Please use something\n'
+                                          '        simple like "orion" or "9oclock", as this is what you use to call the stock command!\n'
+                                          'Owner: The discord owner ID or @mention to DM on empty WMM and capi authentication.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def addFC(self, ctx, FCCode, FCName, owner):
+        # Checking if FC is already in the list, and if FC name is in correct format
+        # Stops if FC is already in list, or if incorrect name format
+        matched = re.match("[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]-[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]", FCCode)
+        isnt_match = not bool(matched)  # If it is NOT a match, we enter the Invalid FC Code condition
+
+        if isnt_match:
+            await ctx.send(f'Invalid Fleet Carrier Code format! Format should look like XXX-YYY')
+            return
+        elif FCCode.upper() in FCDATA.keys():
+            await ctx.send(f'{FCCode} is a code that is already in the Carrier list!')
+            return
+        # check if the alias is already assigned.
+        fc_code = get_fccode(FCName)
+        if fc_code:
+            await ctx.send(f'{FCName} is an alias that is already in the alias list belonging to carrier {fc_code}!')
+            return
+
+        # verify owner ID is valid using server.get_member()
+        try:
+            owner_id = "".join(re.findall(r'\d+',str(owner)))
+            owner_member = ctx.guild.get_member(int(owner_id))
+            if owner_member is None:
+                await ctx.send(f'"{owner}" is not a valid discord user!')
+                return
+        except:
+            await ctx.send(f'"{owner}" is not a valid discord user!!')
+            return
+
+        log.debug('Format is good... Checking database...')
+
+        FCDATA[FCCode.upper()] = {
+            'FCName': FCName.lower(),
+            #'FCMid': midstr, # EDSM Data, removed.
+            #'FCSys': FCSys.lower(), # EDSM Data, removed.
+            'owner': owner_member.id,
+        }
+        save_carrier(FCCode.upper())
+
+        await ctx.send(f'Added {FCCode} to the FC list, under reference name {FCName}')
+
+    @app_commands.command(name="stock", description="Get the current stock of a fleet carrier")
+    @app_commands.guilds(guild_obj)
+    @app_commands.describe(name='Name of the PTN carrier')
+    @app_commands.describe(source='Optional argument, one of "inara" or "capi". Defaults to the freshest of both.')
+    async def slash_stock(self, interaction: discord.Interaction, name: str, source: str = 'auto'):
+        # fetching can take longer than the 3 second interaction deadline, respond once the data arrives.
+        await interaction.response.defer()
+        response = await stock_command(name, source)
+        if 'msg' in response:
+            await interaction.followup.send(response['msg'])
+        elif 'embed' in response:
+            await interaction.followup.send(embed=response['embed'])
+        else:
+            await interaction.followup.send('Something went wrong!')
+
+    @commands.command(name='stock', help='Returns stock of a PTN carrier (carrier needs to be added first)\n'
+                                         'Source: Optional argument, one of "inara" or "capi". Defaults to the freshest of both.')
+    async def stock(self, ctx, fcname, source='auto'):
+        async with ctx.typing():
+            response = await stock_command(fcname, source)
+        if 'msg' in response:
+            await ctx.send(response['msg'])
+        elif 'embed' in response:
+            await ctx.send(embed=response['embed'])
+        else:
+            await ctx.send('Something went wrong!')
+
+    @commands.command(name='del_FC', help='Delete a fleet carrier from the tracking database.\n'
+                                          'FCCode: Carrier ID Code')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def delFC(self, ctx, FCCode):
+        FCCode = FCCode.upper()
+        matched = re.match("[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]-[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]", FCCode)
+        isnt_match = not bool(matched)  # If it is NOT a match, we enter the Invalid FC Code condition
+
+        if isnt_match:
+            await ctx.send(f'Invalid Fleet Carrier Code format! Format should look like XXX-YYY')
+            return
+        if FCCode in FCDATA.keys():
+            fcname = FCDATA[FCCode]['FCName']
+            FCDATA.pop(FCCode)
+            market_cache.invalidate(FCCode)
+            market_snapshots.remove(FCCode)
+            market_fingerprints.remove(FCCode)
+            delete_carrier(FCCode)
+            await ctx.send(f'Carrier {fcname} ({FCCode}) has been removed from the list')
+
+    @commands.command(name='rename_FC', help='Rename a Fleet Carrier alias. \n'
+                                             'FCCode: Carrier ID Code \n'
+                                             'FCName: new name for the Carrier ')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def renameFC(self, ctx, FCCode, FCName):
+        FCCode = FCCode.upper()
+        FCName = FCName.lower()
+
+        matched = re.match("[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]-[a-zA-Z0-9][a-zA-Z0-9][a-zA-Z0-9]", FCCode)
+        isnt_match = not bool(matched)  # If it is NOT a match, we enter the Invalid FC Code condition
+
+        if isnt_match:
+            await ctx.send(f'Invalid Fleet Carrier Code format! Format should look like XXX-YYY')
+            return
+        fc_code = get_fccode(FCName)
+        if fc_code and fc_code != FCCode:
+            await ctx.send(f'{FCName} is an alias that is already in the alias list belonging to carrier {fc_code}!')
+            return
+        if FCCode in FCDATA.keys():
+            fcname_old = FCDATA[FCCode]['FCName']
+            FCDATA[FCCode]['FCName'] = FCName
+            save_carrier(FCCode)
+            await ctx.send(f'Carrier {fcname_old} ({FCCode}) has been renamed to {FCName}')
+
+    @commands.command(name='list', help='Lists all tracked carriers. \n'
+                                        'Filter: use "wmm" to show only wmm-tracked carriers.')
+    async def fclist(self, ctx, Filter=None):
+        log.debug('Listing active carriers')
+        embed, view = carrier_list_message('wmm' if Filter else 'all', 1, ctx.author.id)
+        await ctx.send(embed=embed, view=view)
+
+    @commands.command(name='capi_enable', help='Enable the use of Frontier cAPI for a carriers stock check.\n'
+                                         'FCName: name of an existing fleet carrier(s).\n'
+                                         'Multiple carriers can be specified using comma seperation. \n')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def capienable(self, ctx, FCName):
+        carriers = FCName.split(',')
+        # check all the carriers for an existing auth in one go.
+        probes = await capi_client.carriers([fccode for fccode in map(get_fccode, carriers) if fccode])
+        for carrier in carriers:
+            fccode = get_fccode(carrier)
+            if not fccode:
+                await ctx.send('The requested carrier %s is not in the list! Add carriers using the add_FC command!' % carrier)
+                continue
+            # do we have an existing auth?
+            capi_status, capi_data = probes[fccode]
+            if capi_status != 200:
+                oauth_status, oauth_response = await capi_client.generate(fccode)
+                upstream_log.info("capi_enable response %s - %s", oauth_status, oauth_response,
+                                  extra={'carrier': fccode, 'source': 'capi auth', 'status': oauth_status})
+                if 'token' in oauth_response:
+                    oauth_url = f"{API_HOST}/generate/{fccode}?token={oauth_response['token']}"
+                    message = f'Please allow me access to track your carrier "{carrier} ({fccode})" data by linking me to your Frontier account here: {oauth_url}'
+                    await dm_bot_owner(fccode, FCDATA[fccode]['owner'], message)
+                    await ctx.send(f"cAPI auth URL generated, DM sent to carrier owner.")
+                    FCDATA[fccode]['cAPI'] = True
+                    market_cache.invalidate(fccode)
+                    save_carrier(fccode)
+                else:
+                    await ctx.send("Could not generate auth URL for carrier %s: something went horribly wrong :(" % carrier)
+            else:
+                FCDATA[fccode]['cAPI'] = True
+                market_cache.invalidate(fccode)
+                save_carrier(fccode)
+                await ctx.send(f"cAPI auth already exists for carrier, enabling stock fetching.")
+
+    @commands.command(name='capi_disable', help='Disable the use of Frontier cAPI for a carriers stock check.\n'
+                                         'FCName: name of an existing fleet carrier(s).\n'
+                                         'Multiple carriers can be specified using comma seperation. \n')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def capidisable(self, ctx, FCName):
+        carriers = FCName.split(',')
+        for carrier in carriers:
+            fccode = get_fccode(carrier)
+            if not fccode:
+                await ctx.send('The requested carrier %s is not in the list! Add carriers using the add_FC command!' % carrier)
+                continue
+            FCDATA[fccode].pop('cAPI', None)
+            market_cache.invalidate(fccode)
+            save_carrier(fccode)
+            await ctx.send(f'Carrier {carrier} ({fccode}) cAPI access has been disabled')
+
+    @commands.command(name='set_owner', help='Set the owner of a fleet carrier.\n'
+                                         'FCName: name of an existing fleet carrier.\n'
+                                         'Owner: discord user id or @mention of the owner.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def setowner(self, ctx, FCName, owner):
+        fccode = get_fccode(FCName)
+        if not fccode:
+            await ctx.send('The requested carrier %s is not in the list! Add carriers using the add_FC command!' % FCName)
+            return
+
+        # verify owner ID is valid using server.get_member()
+        try:
+            owner_id = "".join(re.findall(r'\d+',str(owner)))
+            owner_member = ctx.guild.get_member(int(owner_id))
+            if owner_member is None:
+                await ctx.send(f'"{owner}" is not a valid discord user!')
+                return
+        except:
+            await ctx.send(f'"{owner}" is not a valid discord user!!')
+            return
+
+        FCDATA[fccode]['owner'] = owner_member.id
+        save_carrier(fccode)
+        await ctx.send(f'Carrier {FCName} ({fccode}) owner set to {owner_member.mention}')
+
+
+def carrier_list_message(list_filter, page, user_id):
+    # embed and page buttons for a page of ;list, the buttons carry everything needed to turn the page.
+    count, pages = carrier_list.get(list_filter)
+    page = min(max(page, 1), len(pages))
+    embed = discord.Embed(title=f"{count} Tracked Fleet Carriers, Page: #{page} of {len(pages)}")
+    embed.add_field(name = 'Carrier Names', value = '\n'.join(pages[page - 1]))
+    view = None
+    if len(pages) > 1:
+        view = discord.ui.View(timeout=None)
+        view.add_item(CarrierListButton(list_filter, page - 1, user_id, 'prev', disabled=page == 1))
+        view.add_item(CarrierListButton(list_filter, page + 1, user_id, 'next', disabled=page == len(pages)))
+    return embed, view
+
+
+class CarrierListButton(discord.ui.DynamicItem[discord.ui.Button], template=r'fclist:(?P<filter>all|wmm):(?P<page>\d+):(?P<user>\d+):(?P<direction>prev|next)'):
+    """
+    ;list page button. The list filter, target page and the user who ran ;list are kept in the custom_id,
+    so any ;list message can be paged without keeping a view or a coroutine around for it.
+    """
+    def __init__(self, list_filter, page, user_id, direction, disabled=False):
+        super().__init__(discord.ui.Button(
+            emoji="◀️" if direction == 'prev' else "▶️",
+            custom_id=f"fclist:{list_filter}:{page}:{user_id}:{direction}",
+            disabled=disabled,
+        ))
+        self.list_filter = list_filter
+        self.page = page
+        self.user_id = user_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['filter'], int(match['page']), int(match['user']), match['direction'])
+
+    async def callback(self, interaction):
+        # This makes sure nobody except the command sender can interact with the "menu"
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message("Only the person who asked for this list can turn its pages, use ;list for your own.", ephemeral=True)
+            return
+        embed, view = carrier_list_message(self.list_filter, self.page, self.user_id)
+        await interaction.response.edit_message(embed=embed, view=view)
+
+
+async def setup(bot):
+    bot.add_dynamic_items(CarrierListButton)
+    await bot.add_cog(Carriers(bot))
@@ -0,0 +1,143 @@
+"""
+Market history commands, answered from the market history database.
+"""
+
+import time
+from discord.ext import commands
+
+from stockbot.history import market_history
+from stockbot.store import FCDATA, carrier_index, get_fccode
+from stockbot.wmm import WMM_COMMODITIES
+
+
+SPARKS = '▁▂▃▄▅▆▇█'
+
+
+class History(commands.Cog):
+    """
+    Stock history of a carrier's commodity, and the wmm sales report.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        market_history.start()
+
+    async def cog_unload(self):
+        # write what is still buffered.
+        await market_history.stop()
+
+    @commands.command(name='history', help='Show the stock history of a commodity on a fleet carrier.\n'
+                                           'FCName: name or code of the carrier\n'
+                                           'Commodity: name of the commodity, optionally followed by a number of days (default 7)')
+    async def history(self, ctx, fcname, *, commodity):
+        fccode = fcname.upper() if fcname.upper() in FCDATA else get_fccode(fcname)
+        if not fccode:
+            await ctx.send('The requested carrier is not in the list! Add carriers using the add_FC command!')
+            return
+        days = 7
+        name, _, last = commodity.rpartition(' ')
+        if name and last.isdigit():
+            commodity, days = name, int(last)
+        until = time.time()
+        since = until - days * 86400
+        # cAPI commodity names have no spaces, inara's do.
+        names = {commodity.lower(), commodity.lower().replace(' ', '')}
+        series = await market_history.series([fccode], names, since, until, query='history')
+        points = sorted(point for name in names for point in series.get((fccode, name), []))
+        if not points:
+            await ctx.send(f"No {commodity} history recorded for {FCDATA[fccode]['FCName']} in the last {days} days.")
+            return
+        await ctx.send(history_message(FCDATA[fccode]['FCName'], fccode, commodity, days, points, since, until))
+
+    @commands.command(name='wmm_report', help='Report WMM commodity sales and restocks per station and carrier.\n'
+                                              'Days: how many days to report on (default 7)')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def wmm_report(self, ctx, days: int = 7):
+        stations = {station: list(fcids) for station, fcids in carrier_index.wmm.items()}
+        if not stations:
+            await ctx.send('No carriers are being tracked for WMM, add one with ;start_wmm_tracking!')
+            return
+        until = time.time()
+        changes = await market_history.changes([fcid for fcids in stations.values() for fcid in fcids], WMM_COMMODITIES,
+                                                until - days * 86400, until, query='wmm_report')
+        for message in split_message(wmm_report_lines(stations, changes, days)):
+            await ctx.send(message)
+
+
+def stock_changes(points):
+    """
+    Units sold and number of restocks in a series of (timestamp, stock, demand), oldest first,
+    counted the same way as MarketHistory.changes.
+
+    :returns: (units sold, restocks)
+    :rtype: tuple
+    """
+    sold = restocks = 0
+    for (_, before, _), (_, after, _) in zip(points, points[1:]):
+        if after < before:
+            sold += before - after
+        elif after > before:
+            restocks += 1
+    return sold, restocks
+
+
+def sparkline(points, since, until, width=28):
+    # the stock at width evenly spaced times between since and until, blank before the first point.
+    top = max(stock for _, stock, _ in points) or 1
+    line = []
+    index = -1
+    for column in range(width):
+        at = since + (until - since) * (column + 1) / width
+        while index + 1 < len(points) and points[index + 1][0] <= at:
+            index += 1
+        line.append(' ' if index < 0 else SPARKS[points[index][1] * (len(SPARKS) - 1) // top])
+    return ''.join(line)
+
+
+def history_message(fcname, fccode, commodity, days, points, since, until):
+    sold, restocks = stock_changes(points)
+    updated, stock, demand = points[-1]
+    lines = [
+        f"**{fcname} ({fccode})** {commodity.title()}, last {days} days",
+        f"Stock: {stock:,} (demand {demand:,}) as of <t:{updated}:R>",
+        f"Sold: {sold:,} units, restocked {restocks} times, max {max(point[1] for point in points):,}",
+        f"`{sparkline(points, since, until)}`",
+    ]
+    return '\n'.join(lines)
+
+
+def wmm_report_lines(stations, changes, days):
+    # one line per station with its totals, followed by a line per carrier.
+    lines = [f"**WMM report, last {days} days**"]
+    for station, fcids in sorted(stations.items()):
+        carriers = []
+        total_sold = total_restocks = 0
+        for fcid in fcids:
+            sold = restocks = 0
+            for commodity in WMM_COMMODITIES:
+                commodity_sold, commodity_restocks = changes.get((fcid, commodity), (0, 0))
+                sold += commodity_sold
+                restocks += commodity_restocks
+            total_sold += sold
+            total_restocks += restocks
+            carriers.append(f"- {FCDATA[fcid]['FCName']} ({fcid}): {sold:,} sold, {restocks} restocks")
+        lines.append(f"**{station}**: {total_sold:,} sold, {total_restocks} restocks")
+        lines.extend(carriers)
+    return lines
+
+
+def split_message(lines, limit=2000):
+    # join lines into as few messages as fit in discord's message length limit.
+    message = ''
+    for line in lines:
+        if message and len(message) + len(line) + 1 > limit:
+            yield message
+            message = ''
+        message = f"{message}\n{line}" if message else line
+    if message:
+        yield message
+
+
+async def setup(bot):
+    await bot.add_cog(History(bot))
@@ -0,0 +1,93 @@
+"""
+Status commands and the on_ready setup.
+"""
+
+import time
+from discord.ext import commands
+
+import stockbot
+from stockbot.config import ENV, GUILD_ID, MARKET_CACHE_TTL, MARKET_HISTORY_HOURS
+from stockbot.logs import log
+from stockbot.markets import market_cache, market_snapshots
+from stockbot.metrics import loop_lag, start_loop_lag_monitor, start_metrics_server, STARTUP_SECONDS
+from stockbot.sources import MARKET_SOURCES
+from stockbot.upstream import capi_breaker, inara_breaker, oauth_breaker
+from stockbot.util import format_hours
+
+
+class Status(commands.Cog):
+    """
+    Bot health: ping, event loop lag, cache and upstream status.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.ready = False
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        guild = self.bot.get_guild(GUILD_ID)
+
+        log.info('%s is connected to %s (id: %s), bot is running in env: %s', self.bot.user.name, guild.name, guild.id, ENV)
+        if not self.ready:
+            # on_ready fires again after a reconnect, only the first one is the cold start.
+            self.ready = True
+            startup = time.monotonic() - stockbot.STARTED
+            STARTUP_SECONDS.set(startup, phase='ready')
+            log.info("Ready %.2fs after starting", startup)
+
+        start_loop_lag_monitor()
+        await start_metrics_server()
+        self.bot.tree.copy_global_to(guild=guild)
+        await self.bot.tree.sync(guild=guild)
+
+    @commands.hybrid_command(name='stockbot_ping', help='If the bot hasnt crashed, it will respond >pong<')
+    async def ping(self, ctx):
+        await ctx.send('pong!')
+
+    @commands.command(name='loop_lag', help='Show how long the event loop has been blocked for.\n'
+                                            'Reset: use "reset" to clear the recorded maximum.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def looplag(self, ctx, reset=None):
+        recent = loop_lag['recent']
+        average = sum(recent) / len(recent) if recent else 0.0
+        await ctx.send(f"Event loop lag: last {loop_lag['last'] * 1000:.1f}ms, "
+                       f"average {average * 1000:.1f}ms / max {max(recent, default=0.0) * 1000:.1f}ms over the last minute, "
+                       f"max {loop_lag['max'] * 1000:.1f}ms since startup or the last reset.")
+        if reset == 'reset':
+            loop_lag['max'] = 0.0
+
+    @commands.command(name='cache_stats', help='Show market data cache hit/miss counters.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def cachestats(self, ctx):
+        stats = market_cache.stats()
+        await ctx.send(f"Market cache: {stats['entries']}/{market_cache.max_entries} markets cached, "
+                       f"{stats['hits']} hits, {stats['misses']} misses, {stats['shared']} shared in-flight fetches "
+                       f"({stats['hit_rate']:.0%} hit rate). "
+                       f"TTL: cAPI {MARKET_CACHE_TTL['capi']}s, Inara {MARKET_CACHE_TTL['inara']}s.")
+        stats = market_snapshots.stats()
+        await ctx.send(f"Market history: {stats['snapshots']} snapshots of {stats['carriers']} carriers, "
+                       f"{stats['commodities']} commodities, {stats['bytes'] / 1024:.0f} KiB, kept for {MARKET_HISTORY_HOURS:g}h.")
+
+    @commands.command(name='upstream_status', help='Show the circuit breaker state of cAPI, cAPI auth and Inara.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def upstreamstatus(self, ctx):
+        lines = []
+        for breaker in (capi_breaker, oauth_breaker, inara_breaker):
+            line = f"{breaker.name}: {breaker.state} - {breaker.failures} consecutive / {breaker.total_failures} total failures"
+            if breaker.state == 'open':
+                line += f" - retrying in {breaker.retry_in():.0f}s"
+            if breaker.last_error:
+                line += f" - last error: {breaker.last_error}"
+            lines.append(line)
+        for source in MARKET_SOURCES.values():
+            line = f"{source.name} market source: {source.ok} ok / {source.failed} failed fetches"
+            if source.latency is not None:
+                line += f" - {source.latency:.2f}s average"
+            if source.age is not None:
+                line += f" - data {format_hours(source.age / 3600)} old on average"
+            lines.append(line)
+        await ctx.send('\n'.join(lines))
+
+
+async def setup(bot):
+    await bot.add_cog(Status(bot))
@@ -0,0 +1,135 @@
+"""
+WMM tracking commands and the wmm-stock update task.
+"""
+
+import discord
+from discord.ext import commands
+
+from stockbot import config
+from stockbot.channels import ChannelPages, clear_history
+from stockbot.config import CCOWMMCHANNEL, GUILD, WMMCHANNEL
+from stockbot.logs import wmm_log
+from stockbot.store import FCDATA, carrier_index, get_fccode, save_carrier, save_wmm_interval
+from stockbot.wmm import wmm_scheduler
+
+
+class Wmm(commands.Cog):
+    """
+    WMM carrier tracking and the wmm-stock channel update.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.start_wmm_task()
+
+    async def cog_unload(self):
+        # stop refreshing carriers before the connection goes away.
+        await wmm_scheduler.stop()
+
+    @commands.command(name='start_wmm_tracking', help='Start tracking a FC for the WMM stock list. \n'
+                                             'FCName: name of an existing fleet carrier\n'
+                                             'Station: name of the closest station to the carrier. For display purposes only\n'
+                                             '!! STATIONS WITH SPACES IN THE NAMES NEED TO BE "QUOTED LIKE THIS" !!\n')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def addwmm(self, ctx, FCName, station):
+        fccode = get_fccode(FCName)
+        if not fccode:
+            await ctx.send('The requested carrier is not in the list! Add carriers using the add_FC command!')
+            return
+        FCDATA[fccode]['wmm'] = "%s" % station.title()
+        FCDATA[fccode]['notified'] = {}
+        save_carrier(fccode)
+        wmm_scheduler.wake()
+        msg = f'Carrier {FCName} ({fccode}) has been added to WMM stock list. Consider using ;capi_enable to fetch stocks if this is a non-Epic Games carrier.'
+        if 'cAPI' in FCDATA[fccode]:
+            if FCDATA[fccode]['cAPI'] == True:
+                msg = f'Carrier {FCName} ({fccode}) has been added to WMM stock list. cAPI is already enabled.'
+        await ctx.send(msg)
+
+    @commands.command(name='stop_wmm_tracking', help='Stop tracking a Fleet Carrier(s) for the WMM stock list. \n'
+                                             'FCName: name of an existing fleet carrier(s).\n'
+                                             'Multiple carriers can be specified using comma seperation. \n')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def delwmm(self, ctx, FCName):
+        carriers = FCName.split(',')
+        for carrier in carriers:
+            fccode = get_fccode(carrier)
+            if not fccode:
+                await ctx.send('The requested carrier %s is not in the list! Add carriers using the add_FC command!' % carrier)
+                continue
+
+            FCDATA[fccode].pop('wmm', None)
+            FCDATA[fccode].pop('notified', None)
+            save_carrier(fccode)
+            wmm_scheduler.wake()
+            await ctx.send(f'Carrier {carrier} ({fccode}) has been removed from the WMM stock list')
+
+    @commands.command(name='set_wmm_interval', help='Change the wmm-stock update interval.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def setwmminterval(self, ctx, interval):
+        if not interval.isdigit() or int(interval) <= 0:
+            await ctx.send(f'"{interval}" is not a valid interval, it must be a whole number of seconds greater than 0.')
+            return
+        old_interval, config.wmm_interval = config.wmm_interval, int(interval)
+        save_wmm_interval(config.wmm_interval)
+        wmm_scheduler.interval_changed(old_interval, config.wmm_interval)
+        await ctx.send(f'wmm-stock interval changed to {config.wmm_interval} seconds')
+
+    @commands.command(name='get_wmm_interval', help='Get the current wmm-stock update interval.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def getwmminterval(self, ctx):
+        await ctx.send(f'wmm-stock interval is currently {config.wmm_interval} seconds')
+
+    @commands.hybrid_command(name='wmm_stock', help='Manually trigger the wmm stock update without changing the interval.\n'
+                                                    'System: optional, only update the carriers tracked for this WMM system.')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod', 'Certified Carrier')
+    async def wmmstock(self, ctx, system: str = None):
+        if system:
+            station = next((station for station in carrier_index.wmm if station.lower() == system.lower()), None)
+            if station is None:
+                await ctx.send(f'No carriers are being tracked for WMM in {system}.')
+                return
+            wmm_scheduler.trigger(carrier_index.wmm[station])
+            await ctx.send(f'wmm stock update of {station} triggered, please stand by.')
+        else:
+            wmm_scheduler.trigger()
+            await ctx.send(f'wmm stock update triggered, please stand by.')
+        if not wmm_scheduler.is_running():
+            wmm_log.warning("wmm_stock task has failed, restarting.")
+            await ctx.send(f'wmm stock background task has failed, restarting...')
+            await self.start_wmm_task()
+
+    @commands.hybrid_command(name='wmm_status', help='Check the wmm background task status')
+    @commands.has_any_role('Bot Handler', 'Admin', 'Mod')
+    async def wmmstatus(self, ctx):
+        if not wmm_scheduler.is_running():
+            await ctx.send(f'wmm stock background task has failed, restarting...')
+            await self.start_wmm_task()
+        else:
+            next_due = wmm_scheduler.next_due()
+            next_refresh = f", next refresh in {next_due:.0f}s" if next_due is not None else ''
+            await ctx.send(f'wmm stock background task is running, {len(wmm_scheduler.due)} carriers scheduled{next_refresh}.')
+
+    async def start_wmm_task(self):
+        if wmm_scheduler.is_running():
+            wmm_log.info("def start_wmm_task: task is_running(), cannot start.")
+            return False
+        channel = discord.utils.get(self.bot.get_all_channels(), guild__name=GUILD, name=WMMCHANNEL)
+        ccochannel = discord.utils.get(self.bot.get_all_channels(), guild__name=GUILD, name=CCOWMMCHANNEL)
+        wmm_pages = ChannelPages(channel)
+        cco_pages = ChannelPages(ccochannel)
+        for pages in (wmm_pages, cco_pages):
+            if not pages.posted:
+                # we don't know which messages are ours yet, start from a clean channel.
+                wmm_log.info("Clearing last stock update message in #%s", pages.channel)
+                await clear_history(pages.channel)
+        if not wmm_pages.posted:
+            await wmm_pages.render(['Stock Bot initialized, preparing for WMM stock update.'])
+        wmm_log.info("Starting WMM stock background task")
+        await wmm_scheduler.start(wmm_pages, cco_pages)
+
+
+async def setup(bot):
+    await bot.add_cog(Wmm(bot))
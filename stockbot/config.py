@@ -0,0 +1,73 @@
+"""
+Settings read from the environment and the .env file.
+"""
+
+import os
+from dotenv import load_dotenv
+
+
+ENV_DIR = os.getenv('ENV_DIR', '')
+carrierdb = os.path.join(ENV_DIR, '.carriers')
+carrierstore = os.path.join(ENV_DIR, 'carriers.db')
+historystore = os.path.join(ENV_DIR, 'history.db')
+load_dotenv(os.path.join(ENV_DIR, '.env'))
+load_dotenv(carrierdb)
+TOKEN = os.getenv('DISCORD_TOKEN')
+GUILD = os.getenv('DISCORD_GUILD')
+GUILD_ID = int(os.getenv('DISCORD_GUILD_ID', 0))
+CARRIERS = os.getenv('FLEET_CARRIERS')
+WMMCHANNEL = os.getenv('WMM_CHANNEL', '📦wmm-stock')
+CCOWMMCHANNEL = os.getenv('CCO_WMM_CHANNEL', 'cco-wmm-supplies')
+ENV = os.getenv('ENV', 'prod')
+API_HOST = os.getenv('API_HOST')
+API_TOKEN = os.getenv('API_TOKEN')
+INARA_URL = os.getenv('INARA_URL', 'https://inara.cz')
+wmm_interval = int(os.getenv('WMM_INTERVAL', 3600))
+# max carriers fetched at once during a wmm update, and per-source request rates (requests per second).
+WMM_CONCURRENCY = int(os.getenv('WMM_CONCURRENCY', 10))
+CAPI_RATE = float(os.getenv('CAPI_RATE', 5))
+INARA_RATE = float(os.getenv('INARA_RATE', 1))
+# owner DMs: digests sent per second, and how many flushes an undeliverable alert is retried for.
+DM_RATE = float(os.getenv('DM_RATE', 1))
+DM_RETRIES = int(os.getenv('DM_RETRIES', 3))
+# worker processes for the wmm update, each fetching and parsing its own share of the carriers. 0 fetches in the bot process.
+WMM_WORKERS = int(os.getenv('WMM_WORKERS', 0))
+# max carriers asked for in one cAPI proxy batch request.
+CAPI_BATCH_SIZE = int(os.getenv('CAPI_BATCH_SIZE', 50))
+# threads used for html parsing, keeping it off the event loop.
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', 4))
+# how long fetched market data is reused for (seconds, per source), and how many markets are kept.
+MARKET_CACHE_TTL = {
+    'capi': int(os.getenv('MARKET_CACHE_TTL_CAPI', 900)),
+    'inara': int(os.getenv('MARKET_CACHE_TTL_INARA', 300)),
+}
+MARKET_CACHE_SIZE = int(os.getenv('MARKET_CACHE_SIZE', 500))
+# market history: how long fetched markets are kept for, and at most how many per carrier.
+MARKET_HISTORY_HOURS = float(os.getenv('MARKET_HISTORY_HOURS', 24))
+MARKET_HISTORY_SIZE = int(os.getenv('MARKET_HISTORY_SIZE', 200))
+# market history database: seconds between batched writes, all changes are kept for HISTORY_RAW_DAYS,
+# then the last of every hour until HISTORY_HOURLY_DAYS and the last of every day until HISTORY_RETENTION_DAYS.
+HISTORY_FLUSH_SECONDS = float(os.getenv('HISTORY_FLUSH_SECONDS', 30))
+HISTORY_RAW_DAYS = float(os.getenv('HISTORY_RAW_DAYS', 7))
+HISTORY_HOURLY_DAYS = float(os.getenv('HISTORY_HOURLY_DAYS', 90))
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', 365))
+# wmm low stock: forecast from the last WMM_FORECAST_HOURS of history, alert when a carrier will run out within WMM_EMPTY_ALERT_HOURS.
+WMM_FORECAST_HOURS = float(os.getenv('WMM_FORECAST_HOURS', 12))
+WMM_EMPTY_ALERT_HOURS = float(os.getenv('WMM_EMPTY_ALERT_HOURS', 6))
+# seconds to wait for more carrier refreshes before updating the wmm channels.
+WMM_RENDER_DELAY = float(os.getenv('WMM_RENDER_DELAY', 15))
+# ;stock auto: seconds to keep waiting for a fresher source once one has answered.
+STOCK_RACE_DEADLINE = float(os.getenv('STOCK_RACE_DEADLINE', 5))
+# consecutive failures before an upstream is given a rest, and the first/longest rest in seconds.
+BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', 5))
+BREAKER_BACKOFF = int(os.getenv('BREAKER_BACKOFF', 30))
+BREAKER_MAX_BACKOFF = int(os.getenv('BREAKER_MAX_BACKOFF', 1800))
+# prometheus metrics endpoint, set METRICS_PORT=0 to disable it.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))
+# logging: default level, per-logger levels (e.g. "discord=WARNING,stockbot.wmm=DEBUG"),
+# keep 1 in LOG_SAMPLE_RATE of the per-carrier debug messages, and an optional log file.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO' if ENV == 'prod' else 'DEBUG').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'discord=INFO')
+LOG_SAMPLE_RATE = int(os.getenv('LOG_SAMPLE_RATE', 10))
+LOG_FILE = os.getenv('LOG_FILE', '' if ENV == 'prod' else 'discord.log')
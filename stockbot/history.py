@@ -0,0 +1,205 @@
+"""
+Market history database: the stock of every fetched market, kept on disk for months.
+"""
+
+import sqlite3
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from stockbot.config import HISTORY_FLUSH_SECONDS, HISTORY_HOURLY_DAYS, HISTORY_RAW_DAYS, HISTORY_RETENTION_DAYS, historystore
+from stockbot.logs import store_log
+from stockbot.metrics import HISTORY_QUERY_SECONDS, HISTORY_ROWS
+
+
+class MarketHistory:
+    """
+    SQLite time series of the commodity stock, demand and prices of every carrier, storing only changes.
+    Rows are buffered and written in batches off the event loop, and old history is downsampled daily.
+    """
+    COMPACT_INTERVAL = 86400
+    # rows kept for the next flush when writing fails, the oldest are dropped beyond this.
+    MAX_PENDING = 100000
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        # (carrier code, commodity name) -> (time, stock, demand) last recorded, loaded from the database on start.
+        self.last = {}
+        # commodity name -> id, only used on the write thread.
+        self.ids = {}
+        self.task = None
+        self.local = threading.local()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-write')
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-read')
+
+    def connect(self):
+        # one connection per thread, opened on first use.
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS commodities (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)')
+            connection.execute('CREATE TABLE IF NOT EXISTS market_history (carrier TEXT NOT NULL, commodity INTEGER NOT NULL, '
+                               'time INTEGER NOT NULL, stock INTEGER NOT NULL, demand INTEGER NOT NULL, '
+                               'buy_price INTEGER NOT NULL, sell_price INTEGER NOT NULL, '
+                               'PRIMARY KEY (carrier, commodity, time)) WITHOUT ROWID')
+            connection.execute('CREATE TABLE IF NOT EXISTS market_sales (carrier TEXT NOT NULL, commodity INTEGER NOT NULL, '
+                               'day INTEGER NOT NULL, sold INTEGER NOT NULL, restocks INTEGER NOT NULL, '
+                               'PRIMARY KEY (carrier, commodity, day)) WITHOUT ROWID')
+        return connection
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        await self.flush()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for key, last in await loop.run_in_executor(self.writer, self.select_last):
+            # anything recorded since starting is newer.
+            self.last.setdefault(key, last)
+        compacted = 0
+        while True:
+            await asyncio.sleep(HISTORY_FLUSH_SECONDS)
+            try:
+                await self.flush()
+                if time.time() - compacted > self.COMPACT_INTERVAL:
+                    compacted = time.time()
+                    await loop.run_in_executor(self.writer, self.compact, compacted)
+            except sqlite3.Error:
+                store_log.exception("Failed to write the market history")
+
+    def record(self, fccode, commodities, updated):
+        # buffer the commodities of a fetched market whose stock or demand changed since they were last recorded.
+        if self.task is None:
+            # not started, e.g. in a wmm worker process: the bot records the markets its workers send it.
+            return
+        updated = int(updated)
+        for com in commodities:
+            key = (fccode, com['name'].lower())
+            stock, demand = int(com['stock']), int(com['demand'])
+            last = self.last.get(key)
+            if last and (updated <= last[0] or (stock, demand) == last[1:]):
+                continue
+            self.last[key] = (updated, stock, demand)
+            before = last[1] if last else stock
+            self.pending.append((*key, updated, stock, demand, int(com.get('buyPrice', 0)), int(com.get('sellPrice', 0)),
+                                 max(0, before - stock), int(stock > before)))
+
+    async def flush(self):
+        rows, self.pending = self.pending, []
+        if not rows:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.write, rows)
+        except sqlite3.Error:
+            # retry with the next flush, ahead of anything recorded meanwhile.
+            self.pending[:0] = rows
+            if len(self.pending) > self.MAX_PENDING:
+                store_log.warning("Market history is not being written, dropping %d rows", len(self.pending) - self.MAX_PENDING)
+                del self.pending[:-self.MAX_PENDING]
+            raise
+
+    def write(self, rows):
+        db = self.connect()
+        with db:
+            db.execute('BEGIN')
+            missing = {row[1] for row in rows}.difference(self.ids)
+            if missing:
+                db.executemany('INSERT OR IGNORE INTO commodities (name) VALUES (?)', [(name,) for name in missing])
+                self.ids.update((name, commodity_id) for commodity_id, name in db.execute(
+                    'SELECT id, name FROM commodities WHERE name IN (%s)' % ','.join('?' * len(missing)), list(missing)))
+            db.executemany('INSERT OR REPLACE INTO market_history VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [(fccode, self.ids[name], *values) for fccode, name, *values, sold, restocked in rows])
+            db.executemany('INSERT INTO market_sales VALUES (?, ?, ?, ?, ?) ON CONFLICT (carrier, commodity, day) DO UPDATE '
+                           'SET sold = sold + excluded.sold, restocks = restocks + excluded.restocks',
+                           [(fccode, self.ids[name], updated // 86400 * 86400, sold, restocked)
+                            for fccode, name, updated, *values, sold, restocked in rows if sold or restocked])
+        HISTORY_ROWS.inc(len(rows))
+
+    def compact(self, now):
+        # downsample and expire old history: the last row of each hour after HISTORY_RAW_DAYS, of each day after
+        # HISTORY_HOURLY_DAYS, nothing after HISTORY_RETENTION_DAYS.
+        db = self.connect()
+        with db:
+            db.execute('BEGIN')
+            for days, bucket in ((HISTORY_RAW_DAYS, 3600), (HISTORY_HOURLY_DAYS, 86400)):
+                # drop every row that has a later one in the same bucket.
+                db.execute('DELETE FROM market_history WHERE time < ? AND EXISTS (SELECT 1 FROM market_history AS later '
+                           'WHERE later.carrier = market_history.carrier AND later.commodity = market_history.commodity '
+                           'AND later.time > market_history.time AND later.time < (market_history.time / ? + 1) * ?)',
+                           (int(now - days * 86400), bucket, bucket))
+            removed = db.execute('DELETE FROM market_history WHERE time < ?', (int(now - HISTORY_RETENTION_DAYS * 86400),)).rowcount
+            db.execute('DELETE FROM market_sales WHERE day < ?', (int(now - HISTORY_RETENTION_DAYS * 86400),))
+        store_log.info("Compacted the market history, %d rows past retention removed", removed)
+
+    def select_last(self):
+        # the last row of every carrier and commodity, sqlite takes the other columns from the row with the max time.
+        rows = self.connect().execute('SELECT carrier, name, MAX(time), stock, demand FROM market_history '
+                                      'JOIN commodities ON commodities.id = market_history.commodity GROUP BY carrier, commodity')
+        return [((fccode, name), (updated, stock, demand)) for fccode, name, updated, stock, demand in rows]
+
+    async def series(self, fccodes, commodities, since, until=None, query='series'):
+        """
+        The recorded stock and demand of commodities on carriers between since and until (default now).
+        Each series starts with the last row recorded before since, if there is one, as the stock at since.
+
+        :returns: dict of (carrier code, lowercase commodity name) to a list of (timestamp, stock, demand), oldest first.
+        :rtype: dict
+        """
+        return await self.query(self.select_series, fccodes, commodities, since, until, query)
+
+    async def changes(self, fccodes, commodities, since, until=None, query='changes'):
+        """
+        Units sold and number of restocks of commodities on carriers on the days from since to until (default now).
+
+        :returns: dict of (carrier code, lowercase commodity name) to (units sold, restocks).
+        :rtype: dict
+        """
+        return await self.query(self.select_changes, fccodes, commodities, since, until, query)
+
+    async def query(self, select, fccodes, commodities, since, until, query):
+        # include what is still buffered.
+        await self.flush()
+        started = time.monotonic()
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.reader, select, list(fccodes), [commodity.lower() for commodity in commodities], int(since), int(until or time.time()))
+        HISTORY_QUERY_SECONDS.observe(time.monotonic() - started, query=query)
+        return result
+
+    def select_series(self, fccodes, commodities, since, until):
+        db = self.connect()
+        ids = dict(db.execute('SELECT id, name FROM commodities WHERE name IN (%s)' % ','.join('?' * len(commodities)), commodities))
+        series = {}
+        for fccode in fccodes:
+            for commodity_id, name in ids.items():
+                start = db.execute('SELECT time, stock, demand FROM market_history WHERE carrier = ? AND commodity = ? AND time < ? '
+                                   'ORDER BY time DESC LIMIT 1', (fccode, commodity_id, since)).fetchone()
+                if start:
+                    series[(fccode, name)] = [start]
+        rows = db.execute('SELECT carrier, commodity, time, stock, demand FROM market_history WHERE carrier IN (%s) AND commodity IN (%s) '
+                          'AND time >= ? AND time <= ? ORDER BY carrier, commodity, time'
+                          % (','.join('?' * len(fccodes)), ','.join('?' * len(ids))), [*fccodes, *ids, since, until])
+        for fccode, commodity_id, timestamp, stock, demand in rows:
+            series.setdefault((fccode, ids[commodity_id]), []).append((timestamp, stock, demand))
+        return series
+
+    def select_changes(self, fccodes, commodities, since, until):
+        rows = self.connect().execute(
+            'SELECT carrier, name, SUM(sold), SUM(restocks) FROM market_sales JOIN commodities ON commodities.id = market_sales.commodity '
+            'WHERE carrier IN (%s) AND name IN (%s) AND day >= ? AND day <= ? GROUP BY carrier, commodity'
+            % (','.join('?' * len(fccodes)), ','.join('?' * len(commodities))), [*fccodes, *commodities, since // 86400 * 86400, until])
+        return {(fccode, name): (sold, restocks) for fccode, name, sold, restocks in rows}
+
+
+market_history = MarketHistory(historystore)
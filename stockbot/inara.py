@@ -0,0 +1,155 @@
+"""
+Fetching and parsing inara station market pages.
+"""
+
+import re
+import html
+from datetime import datetime
+
+from stockbot.config import INARA_URL
+from stockbot.logs import upstream_log
+from stockbot.upstream import get_http_session, inara_breaker, inara_limiter
+
+
+def inara_market_time(stn_data):
+    # timestamp of the "Market update" shown on inara, None if it can't be read.
+    try:
+        return datetime.strptime(stn_data['market_updated'].split('(')[1][0:-1], "%d %b %Y, %I:%M%p").timestamp()
+    except (IndexError, ValueError):
+        return None
+
+
+async def inara_market_page(fcid, headers=None):
+    # returns (status, headers, content), status is 304 with no content if headers had validators that still match.
+    # a 4xx is returned as it is, it's about this carrier. 429 and 5xx raise, as inara itself is unavailable.
+    URL = "%s/elite/station-market/?search=%s" % (INARA_URL, fcid)
+
+    async def request():
+        await inara_limiter.wait()
+        session = await get_http_session()
+        async with session.get(URL, headers=headers) as page:
+            if page.status == 304:
+                return page.status, page.headers, b''
+            if page.status == 429 or page.status >= 500:
+                page.raise_for_status()
+            return page.status, page.headers, await page.read()
+    return await inara_breaker.call(request)
+
+
+# The inara station-market page is large, but we only need the header, the market update
+# timestamp and the market table. These patterns pull those out directly instead of
+# building a full BeautifulSoup tree of the page.
+INARA_HEADER_RE = re.compile(r'<div[^>]*class="[^"]*\bheadercontent\b[^"]*"[^>]*>.*?<h2[^>]*>(.*?)</h2>', re.S)
+INARA_LINK_RE = re.compile(r'<a\s[^>]*?href="([^"]*)"[^>]*>(.*?)</a>', re.S)
+INARA_UPDATED_RE = re.compile(r'<div[^>]*>Market update</div>\s*<div[^>]*>(.*?)</div>', re.S)
+INARA_MAINBLOCK_RE = re.compile(r'<div[^>]*class="[^"]*\bmainblock\b[^"]*"')
+INARA_ROW_RE = re.compile(r'<tr([^>]*)>(.*?)</tr>', re.S)
+INARA_CELL_RE = re.compile(r'<td[^>]*>(.*?)</td>', re.S)
+INARA_SUBHEADER_RE = re.compile(r'class="[^"]*\bsubheader\b')
+INARA_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def inara_text(fragment):
+    # equivalent of BeautifulSoup's get_text() for a small html fragment.
+    return html.unescape(INARA_TAG_RE.sub('', fragment))
+
+
+def inara_int(text):
+    return int(text.replace('-', '0').replace(',', '').replace(' Cr', ''))
+
+
+def inara_header(page):
+    # returns the carrier name, carrier link and system name from the page header.
+    header_info = INARA_HEADER_RE.search(page).group(1)
+    carrier_system_info = INARA_LINK_RE.findall(header_info)
+    return inara_text(carrier_system_info[0][1]), carrier_system_info[0][0], inara_text(carrier_system_info[1][1])
+
+
+def parse_inara_market(fcid, content):
+    try:
+        return parse_inara_market_fast(fcid, content)
+    except (AttributeError, IndexError, ValueError) as e:
+        # the page layout changed or this is not a market page, let BeautifulSoup have a go.
+        upstream_log.warning("Fast inara parser failed for carrier %s (%s), falling back to BeautifulSoup", fcid, e,
+                             extra={'carrier': fcid, 'source': 'inara'})
+        return parse_inara_market_soup(fcid, content)
+
+
+def parse_inara_market_fast(fcid, content):
+    page = content.decode('utf-8', errors='replace')
+    carrier, href, system = inara_header(page)
+
+    # Find market info
+    updated = inara_text(INARA_UPDATED_RE.search(page).group(1))
+    mainblock = [m.start() for m in INARA_MAINBLOCK_RE.finditer(page)]
+    table = page.index('<table', mainblock[1])
+    tbody = page.index('<tbody', table)
+    tbody_end = page.index('</tbody>', tbody)
+    marketdata = []
+    for rowattrs, row in INARA_ROW_RE.findall(page, tbody, tbody_end):
+        if INARA_SUBHEADER_RE.search(rowattrs):
+            continue
+        cells = [inara_text(cell) for cell in INARA_CELL_RE.findall(row)]
+        rn = cells[0]
+        commodity = {
+            'id': rn,
+            'name': rn,
+            'sellPrice': inara_int(cells[1]),
+            'buyPrice': inara_int(cells[3]),
+            'demand': inara_int(cells[2]),
+            'stock': inara_int(cells[4])
+        }
+        marketdata.append(commodity)
+    data = {}
+    data['name'] = system
+    data['currentStarSystem'] = system
+    data['full_name'] = carrier
+    data['sName'] = fcid
+    data['market_updated'] = updated
+    data['commodities'] = marketdata
+    return data
+
+
+def parse_inara_market_soup(fcid, content):
+    # only needed when the page layout changes, so only imported then.
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    mainblock = soup.find_all('div', class_='mainblock')
+
+    # Find carrier and system info
+    header = soup.find_all("div", class_="headercontent")
+    header_info = header[0].find("h2")
+    carrier_system_info = header_info.find_all('a', href=True)
+    carrier = carrier_system_info[0].text
+    system = carrier_system_info[1].text
+
+    # Find market info
+    updated = soup.find("div", text="Market update").next_sibling.get_text()
+    # main_content = soup.find('div', class_="maincontent0")
+    table = mainblock[1].find('table')
+    tbody = table.find("tbody")
+    rows = tbody.find_all('tr')
+    marketdata = []
+    for row in rows:
+        rowclass = row.attrs.get("class") or []
+        if "subheader" in rowclass:
+            continue
+        cells = row.find_all("td")
+        rn = cells[0].get_text()
+        commodity = {
+            'id': rn,
+            'name': rn,
+            'sellPrice': int(cells[1].get_text().replace('-', '0').replace(',', '').replace(' Cr', '')),
+            'buyPrice': int(cells[3].get_text().replace('-', '0').replace(',', '').replace(' Cr', '')),
+            'demand': int(cells[2].get_text().replace('-', '0').replace(',', '')),
+            'stock': int(cells[4].get_text().replace('-', '0').replace(',', ''))
+        }
+        marketdata.append(commodity)
+    data = {}
+    data['name'] = system
+    data['currentStarSystem'] = system
+    data['full_name'] = carrier
+    data['sName'] = fcid
+    data['market_updated'] = updated
+    data['commodities'] = marketdata
+    return data
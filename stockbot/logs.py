@@ -0,0 +1,105 @@
+"""
+Logging setup: plain or json lines, written from a background thread.
+"""
+
+import os
+import sys
+import json
+import atexit
+import copy
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from datetime import datetime, timezone
+
+from stockbot.config import ENV_DIR, LOG_FILE, LOG_LEVEL, LOG_LEVELS, LOG_SAMPLE_RATE
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one json object per line. The carrier, source, duration and status
+    fields are included when passed to the logger as extra={...}.
+    """
+    FIELDS = ('carrier', 'source', 'duration', 'status')
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through 1 in `rate` of the records logged with extra={'sample': True}, counted per message.
+    Used for messages logged for every carrier in every wmm update. Warnings and above always pass.
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(rate, 1)
+        self.seen = {}
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False) or record.levelno >= logging.WARNING:
+            return True
+        seen = self.seen.get(record.msg, 0)
+        self.seen[record.msg] = seen + 1
+        return seen % self.rate == 0
+
+
+class StructuredQueueHandler(QueueHandler):
+    # QueueHandler flattens records into a formatted string, keep the fields for JsonFormatter instead.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_file=LOG_FILE):
+    """
+    Route all logging through a queue, so the caller only pays for enqueueing a record.
+    A background QueueListener thread formats the records as json and writes them out.
+    """
+    queue = SimpleQueue()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(filename=os.path.join(ENV_DIR, log_file), encoding='utf-8', mode='w'))
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    queue_handler = StructuredQueueHandler(queue)
+    queue_handler.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for setting in filter(None, LOG_LEVELS.split(',')):
+        name, _, level = setting.partition('=')
+        try:
+            if not name.strip():
+                raise ValueError
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+        except ValueError:
+            # a typo in the config shouldn't stop the bot from starting.
+            log.warning("Ignoring LOG_LEVELS entry %r, expected logger=LEVEL, e.g. discord=WARNING", setting)
+
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+log = logging.getLogger('stockbot')
+wmm_log = logging.getLogger('stockbot.wmm')
+upstream_log = logging.getLogger('stockbot.upstream')
+store_log = logging.getLogger('stockbot.store')
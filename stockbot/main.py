@@ -0,0 +1,22 @@
+"""
+Starting the bot: logging, the tracked carriers, then the discord connection.
+"""
+
+import time
+
+import stockbot
+from stockbot.config import TOKEN
+from stockbot.logs import log, setup_logging
+from stockbot.metrics import STARTUP_SECONDS
+from stockbot import store
+from stockbot.client import bot
+
+
+def main():
+    setup_logging()
+    STARTUP_SECONDS.set(time.monotonic() - stockbot.STARTED, phase='import')
+    store.load()
+    loaded = time.monotonic() - stockbot.STARTED
+    STARTUP_SECONDS.set(loaded, phase='carriers')
+    log.info("Loaded %d carriers %.2fs after starting", len(store.FCDATA), loaded)
+    bot.run(TOKEN, log_handler=None)
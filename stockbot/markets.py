@@ -0,0 +1,327 @@
+"""
+Market cache, response fingerprints and market history.
+"""
+
+import hashlib
+import asyncio
+import time
+from collections import OrderedDict, deque
+from array import array
+
+from stockbot.config import MARKET_CACHE_SIZE, MARKET_CACHE_TTL, MARKET_HISTORY_HOURS, MARKET_HISTORY_SIZE
+from stockbot.metrics import CacheMetric, MARKET_FETCHES
+
+
+class MarketCache:
+    """
+    LRU cache of carrier market data keyed by (carrier code, source), with a TTL per source.
+    Concurrent lookups of the same market share a single in-flight fetch.
+    Failed fetches (False or an exception) are not cached.
+    """
+    def __init__(self, ttls, max_entries):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        # key -> (market, copy of it marked stale), see stale().
+        self.stale_markets = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    async def get(self, fccode, source, fetch):
+        key = (fccode, source)
+        entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttls.get(source, 0):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        if key in self.inflight:
+            self.shared += 1
+            return await asyncio.shield(self.inflight[key])
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self.inflight[key] = task
+        task.add_done_callback(lambda t: self._fetched(key, t))
+        # shield so a cancelled caller doesn't cancel the fetch for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    def _fetched(self, key, task):
+        if self.inflight.get(key) is not task:
+            # invalidated while fetching, the result may already be stale.
+            return
+        self.inflight.pop(key)
+        if task.cancelled() or task.exception() is not None or not task.result():
+            return
+        self.put(*key, task.result())
+
+    def put(self, fccode, source, stn_data):
+        # cache a market fetched elsewhere, e.g. by a wmm worker process.
+        key = (fccode, source)
+        self.entries[key] = (time.monotonic(), time.time(), stn_data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            key, entry = self.entries.popitem(last=False)
+            self.stale_markets.pop(key, None)
+
+    def fresh(self, fccode, source):
+        # True if a lookup would be answered without a new fetch.
+        key = (fccode, source)
+        entry = self.entries.get(key)
+        return key in self.inflight or bool(entry) and time.monotonic() - entry[0] < self.ttls.get(source, 0)
+
+    def last_good(self, fccode, source):
+        # the last successful fetch, however old, as (fetched timestamp, data). None if never fetched.
+        entry = self.entries.get((fccode, source))
+        return entry[1:] if entry else None
+
+    def stale(self, fccode, source):
+        """
+        The last good market with 'stale' set to when it was fetched, for while the upstream is unavailable.
+        The same object is returned until a new market is cached, so it is seen as unchanged.
+
+        :returns: the stale market, or None if never fetched.
+        :rtype: dict
+        """
+        key = (fccode, source)
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        stale = self.stale_markets.get(key)
+        if stale is None or stale[0] is not entry[2]:
+            stale = self.stale_markets[key] = (entry[2], dict(entry[2], stale=entry[1]))
+        return stale[1]
+
+    def invalidate(self, fccode):
+        for source in self.ttls:
+            self.entries.pop((fccode, source), None)
+            self.stale_markets.pop((fccode, source), None)
+            self.inflight.pop((fccode, source), None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.shared
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'hit_rate': (self.hits + self.shared) / lookups if lookups else 0.0,
+        }
+
+
+market_cache = MarketCache(MARKET_CACHE_TTL, MARKET_CACHE_SIZE)
+MARKET_CACHE_LOOKUPS = CacheMetric('stockbot_market_cache_lookups_total', 'Market cache lookups by result.', market_cache)
+
+
+class MarketFingerprints:
+    """
+    Remembers the ETag, Last-Modified and a content hash of the last response parsed for each
+    (carrier code, source), so an unchanged market is recognised before it is parsed again.
+    Markets that are unchanged are returned as the previously parsed object, so later stages can
+    skip them with an `is` check.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    @staticmethod
+    def fingerprint(status, headers, content):
+        return {
+            'not_modified': status == 304,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': hashlib.blake2b(content, digest_size=16).digest() if status != 304 else None,
+        }
+
+    def headers(self, fccode, source):
+        # conditional request headers for the last response we parsed.
+        entry = self.entries.get((fccode, source), {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def matches(self, fccode, source, fingerprint):
+        entry = self.entries.get((fccode, source))
+        if fingerprint['not_modified']:
+            result = 'not_modified'
+        elif entry and fingerprint['etag'] and fingerprint['etag'] == entry['etag']:
+            result = 'not_modified'
+        elif entry and fingerprint['hash'] == entry['hash']:
+            result = 'same_hash'
+        else:
+            return False
+        if not fingerprint['not_modified']:
+            # keep any new validators to send next time.
+            self.entries[(fccode, source)] = fingerprint
+        MARKET_FETCHES.inc(source=source, result=result)
+        return True
+
+    def parsed(self, fccode, source, fingerprint, stn_data, previous):
+        # remember a newly parsed response. returns the previous market instead if nothing in it changed.
+        if not stn_data:
+            return stn_data
+        self.entries[(fccode, source)] = fingerprint
+        if previous and stn_data == previous[1]:
+            MARKET_FETCHES.inc(source=source, result='same_data')
+            return previous[1]
+        MARKET_FETCHES.inc(source=source, result='changed')
+        return stn_data
+
+    def remove(self, fccode):
+        for key in [key for key in self.entries if key[0] == fccode]:
+            del self.entries[key]
+
+
+market_fingerprints = MarketFingerprints()
+
+
+class MarketSnapshot:
+    """
+    A carrier market at one point in time, stored column-wise: `commodities` holds interned commodity ids
+    and each of MarketSnapshots.COLUMNS is an array of the same length.
+    """
+    __slots__ = ('time', 'source', 'commodities', 'columns')
+
+    def __init__(self, time, source, commodities, columns):
+        self.time = time
+        self.source = source
+        self.commodities = commodities
+        self.columns = columns
+
+    def get(self, commodity_id, column='stock'):
+        # value of column for a commodity, None if the carrier doesn't list it.
+        try:
+            return self.columns[column][self.commodities.index(commodity_id)]
+        except ValueError:
+            return None
+
+    def nbytes(self):
+        arrays = (self.commodities, *self.columns.values())
+        return sum(a.itemsize * len(a) for a in arrays)
+
+
+class MarketSnapshots:
+    """
+    Rolling history of fetched carrier markets, kept as compact MarketSnapshot columns instead of the
+    per-commodity dicts. Commodity names are interned to small integer ids shared by all carriers.
+    Snapshots older than `retention` seconds are dropped, and at most `max_snapshots` are kept per carrier.
+    """
+    COLUMNS = ('stock', 'demand', 'buyPrice', 'sellPrice')
+
+    def __init__(self, retention, max_snapshots):
+        self.retention = retention
+        self.max_snapshots = max_snapshots
+        self.commodity_ids = {}
+        self.commodity_names = []
+        self.carriers = {}
+
+    def intern(self, name):
+        # commodity id for name, case insensitive.
+        key = name.lower()
+        commodity_id = self.commodity_ids.get(key)
+        if commodity_id is None:
+            commodity_id = self.commodity_ids[key] = len(self.commodity_names)
+            self.commodity_names.append(key)
+        return commodity_id
+
+    def record(self, fccode, source, commodities, fetched=None):
+        commodity_ids = array('H', (self.intern(com['name']) for com in commodities))
+        columns = {column: array('l', (int(com[column]) for com in commodities)) for column in self.COLUMNS}
+        snapshot = MarketSnapshot(fetched or time.time(), source, commodity_ids, columns)
+        history = self.carriers.get(fccode)
+        if history is None:
+            history = self.carriers[fccode] = deque(maxlen=self.max_snapshots)
+        history.append(snapshot)
+        self.expire(fccode)
+        return snapshot
+
+    def expire(self, fccode, now=None):
+        history = self.carriers.get(fccode, ())
+        cutoff = (now or time.time()) - self.retention
+        while history and history[0].time < cutoff:
+            history.popleft()
+
+    def latest(self, fccode):
+        history = self.carriers.get(fccode)
+        return history[-1] if history else None
+
+    def history(self, fccode, since=None):
+        # snapshots of a carrier, oldest first, optionally only those after since.
+        return [snapshot for snapshot in self.carriers.get(fccode, ()) if since is None or snapshot.time >= since]
+
+    def series(self, fccode, commodity, column='stock', since=None):
+        """
+        Time series of a single commodity column for a carrier, for trend queries.
+
+        :returns: list of (timestamp, value), oldest first, skipping snapshots without the commodity.
+        :rtype: list
+        """
+        commodity_id = self.commodity_ids.get(commodity.lower())
+        if commodity_id is None:
+            return []
+        series = []
+        for snapshot in self.history(fccode, since):
+            value = snapshot.get(commodity_id, column)
+            if value is not None:
+                series.append((snapshot.time, value))
+        return series
+
+    def forecast(self, fccodes, commodity_ids, window, now=None):
+        """
+        Estimate how long each carrier has left of each commodity, from a least squares fit of stock over time.
+        Only the snapshots in the last `window` seconds since the last restock are used.
+        The fit is deliberately scalar: walking back stops at the last restock, usually after a few snapshots,
+        which is cheaper than building a stock matrix over the whole window for the handful of WMM commodities.
+
+        :returns: dict of (carrier code, commodity id) to hours until empty, for commodities that are being depleted.
+        :rtype: dict
+        """
+        now = now or time.time()
+        forecasts = {}
+        for fccode in fccodes:
+            history = self.history(fccode, now - window)
+            if len(history) < 2:
+                continue
+            latest = history[-1]
+            for commodity_id in commodity_ids:
+                # walk back from the latest snapshot while stock was falling, summing for the fit as we go.
+                n = sum_t = sum_s = sum_tt = sum_ts = 0
+                previous = None
+                for snapshot in reversed(history):
+                    stock = snapshot.get(commodity_id)
+                    if stock is None or previous is not None and stock < previous:
+                        break
+                    t = snapshot.time - latest.time
+                    n += 1
+                    sum_t += t
+                    sum_s += stock
+                    sum_tt += t * t
+                    sum_ts += t * stock
+                    previous = stock
+                variance = n * sum_tt - sum_t * sum_t
+                if n < 2 or variance <= 0:
+                    continue
+                rate = (n * sum_ts - sum_t * sum_s) / variance
+                if rate >= 0:
+                    continue
+                # project from the fitted stock at the latest snapshot.
+                fitted = (sum_s - rate * sum_t) / n
+                forecasts[(fccode, commodity_id)] = max(0.0, fitted / -rate - (now - latest.time)) / 3600
+        return forecasts
+
+    def remove(self, fccode):
+        self.carriers.pop(fccode, None)
+
+    def stats(self):
+        snapshots = [snapshot for history in self.carriers.values() for snapshot in history]
+        return {
+            'carriers': len(self.carriers),
+            'snapshots': len(snapshots),
+            'commodities': len(self.commodity_names),
+            'bytes': sum(snapshot.nbytes() for snapshot in snapshots),
+        }
+
+
+market_snapshots = MarketSnapshots(MARKET_HISTORY_HOURS * 3600, MARKET_HISTORY_SIZE)
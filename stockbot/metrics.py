@@ -0,0 +1,166 @@
+"""
+Prometheus metrics, the /metrics endpoint and the event loop lag monitor.
+"""
+
+import asyncio
+from aiohttp import web
+from collections import deque
+
+from stockbot.config import METRICS_HOST, METRICS_PORT
+from stockbot.logs import log
+
+
+class Metric:
+    """
+    A prometheus metric with optional labels, rendered in the text exposition format.
+    Use one of the Counter, Gauge or Histogram subclasses.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        METRICS.append(self)
+
+    @staticmethod
+    def labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+        return '{%s}' % ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{self.labels(labels)} {value}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        if key not in self.values:
+            self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        series = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def samples(self):
+        for key, series in self.values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, series['buckets']):
+                yield f"{self.name}_bucket", dict(labels, le=bound), count
+            yield f"{self.name}_bucket", dict(labels, le='+Inf'), series['count']
+            yield f"{self.name}_sum", labels, series['sum']
+            yield f"{self.name}_count", labels, series['count']
+
+
+class CacheMetric(Metric):
+    # cache hit/miss counters, read from the cache's stats() when scraped.
+    type = 'counter'
+
+    def __init__(self, name, help, cache):
+        super().__init__(name, help)
+        self.cache = cache
+
+    def samples(self):
+        stats = self.cache.stats()
+        for result in ('hits', 'misses', 'shared'):
+            yield self.name, {'result': result}, stats[result]
+
+
+METRICS = []
+UPSTREAM_REQUEST_SECONDS = Histogram('stockbot_upstream_request_seconds', 'Time taken by requests to cAPI, cAPI auth and Inara.')
+UPSTREAM_REQUESTS = Counter('stockbot_upstream_requests_total', 'Upstream requests by result: ok, error or rejected by an open circuit.')
+CARRIER_FETCH_SECONDS = Gauge('stockbot_carrier_fetch_seconds', 'How long the last wmm fetch of each carrier took, including waiting for a slot.')
+COMMAND_SECONDS = Histogram('stockbot_command_seconds', 'Time taken to run each bot command.')
+WMM_CYCLE_SECONDS = Histogram('stockbot_wmm_cycle_seconds', 'Time taken by each wmm refresh of the carriers that were due.')
+WMM_CARRIERS = Gauge('stockbot_wmm_carriers', 'Carriers shown in the last wmm channel update.')
+WMM_CARRIERS_PROCESSED = Counter('stockbot_wmm_carriers_processed_total', 'Carriers processed by wmm stock updates, by the source used.')
+MARKET_FETCHES = Counter('stockbot_market_fetches_total', 'Upstream market responses by source and result: not_modified (304 or same ETag), '
+                                                          'same_hash and same_data skip parsing or rendering, changed is new data.')
+WMM_REFRESHED_CARRIERS = Counter('stockbot_wmm_refreshed_carriers_total', 'Carriers refreshed by the wmm scheduler, by whether their market changed.')
+STOCK_TABLE_RENDERS = Counter('stockbot_stock_table_renders_total', 'Stock command tables rendered, or reused from the render cache.')
+WMM_RENDERS_SKIPPED = Counter('stockbot_wmm_renders_skipped_total', 'Wmm refreshes where no market changed, so the channels were not re-rendered.')
+HISTORY_ROWS = Counter('stockbot_history_rows_written_total', 'Commodity stock changes written to the market history database.')
+HISTORY_QUERY_SECONDS = Histogram('stockbot_history_query_seconds', 'Time taken by market history database queries, by query.')
+WMM_WORKER_STARTS = Counter('stockbot_wmm_worker_starts_total', 'Wmm worker processes started, by worker. More than one start for a worker means it died and was restarted.')
+OWNER_DMS = Counter('stockbot_owner_dms_total', 'Owner notifications queued, and digest DMs sent, failed or dropped after too many failures.')
+DISCORD_REQUESTS = Counter('stockbot_discord_requests_total', 'Discord messages sent, edited and deleted by the wmm update and owner DMs.')
+STARTUP_SECONDS = Gauge('stockbot_startup_seconds', 'Seconds from starting the bot until it was imported, had loaded its carriers and was ready.')
+EVENT_LOOP_LAG_SECONDS = Histogram('stockbot_event_loop_lag_seconds', 'How late the event loop woke from a short sleep.',
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+metrics_runner = None
+
+
+async def metrics_handler(request):
+    body = '\n'.join(metric.render() for metric in METRICS) + '\n'
+    return web.Response(text=body, content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics_server():
+    # serve METRICS on http://METRICS_HOST:METRICS_PORT/metrics, once.
+    global metrics_runner
+    if metrics_runner is not None or not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    metrics_runner = web.AppRunner(app)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    log.info("Serving metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+
+# how late the event loop wakes from a short sleep, which is how long it was blocked.
+LOOP_LAG_INTERVAL = 0.5
+loop_lag = {'last': 0.0, 'max': 0.0, 'recent': deque(maxlen=120)}
+loop_lag_task = None
+
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+        loop_lag['last'] = lag
+        loop_lag['max'] = max(loop_lag['max'], lag)
+        loop_lag['recent'].append(lag)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+
+def start_loop_lag_monitor():
+    # on_ready fires again on reconnect, only ever run one monitor.
+    global loop_lag_task
+    if loop_lag_task is None or loop_lag_task.done():
+        loop_lag_task = asyncio.create_task(monitor_loop_lag())
@@ -0,0 +1,253 @@
+"""
+Market sources for ;stock and the wmm update, and the cached get_fc_stock.
+"""
+
+import json
+import asyncio
+import time
+
+from stockbot.capi import CapiError, capi_client, from_hex
+from stockbot.config import STOCK_RACE_DEADLINE
+from stockbot.history import market_history
+from stockbot.inara import inara_market_page, inara_market_time, parse_inara_market
+from stockbot.logs import upstream_log
+from stockbot.markets import market_cache, market_fingerprints, market_snapshots
+from stockbot.store import FCDATA
+from stockbot.upstream import UPSTREAM_ERRORS, run_blocking
+
+
+async def inara_fc_market_data(fcid):
+    # print("Searching inara market data for station: %s (%s)" % ( stationid, fcid ))
+    try:
+        previous = market_cache.last_good(fcid, 'inara')
+        # only ask for changes if we still have the market to fall back on.
+        headers = market_fingerprints.headers(fcid, 'inara') if previous else {}
+        status, response_headers, content = await inara_market_page(fcid, headers)
+        if status >= 400:
+            upstream_log.warning("Inara returned %s for carrier %s", status, fcid, extra={'carrier': fcid, 'source': 'inara'})
+            return False
+        fingerprint = market_fingerprints.fingerprint(status, response_headers, content)
+        if previous and market_fingerprints.matches(fcid, 'inara', fingerprint):
+            return previous[1]
+        stn_data = await run_blocking(parse_inara_market, fcid, content)
+        return market_fingerprints.parsed(fcid, 'inara', fingerprint, stn_data, previous)
+    except UPSTREAM_ERRORS:
+        # inara itself is unavailable, let get_fc_stock decide whether to serve the last known market.
+        raise
+    except Exception as e:
+        upstream_log.warning("Exception getting inara data for carrier %s: %s", fcid, e, extra={'carrier': fcid, 'source': 'inara'})
+        return False
+
+
+async def capi_fc_market_data(fcid):
+    # get stocks from capi and format as inara data.
+    status, stn_data = await capi_client.carrier(fcid)
+    if status != 200:
+        raise CapiError(status, stn_data)
+    if 'market' not in stn_data:
+        upstream_log.info("No market data for %s", fcid, extra={'carrier': fcid, 'source': 'capi'})
+        return False
+    # the proxy sends no validators, fingerprint the carrier data itself.
+    fingerprint = market_fingerprints.fingerprint(status, {}, json.dumps(stn_data, sort_keys=True).encode())
+    previous = market_cache.last_good(fcid, 'capi')
+    if previous and market_fingerprints.matches(fcid, 'capi', fingerprint):
+        return previous[1]
+    stn_data['full_name'] = f"{from_hex(stn_data['name']['vanityName']).title().strip()} ({stn_data['name']['callsign']})"
+    stn_data['name'] = stn_data['currentStarSystem']
+    stn_data['sName'] = fcid
+    stn_data['market_updated'] = 'cAPI'
+    # remove commodity from list if it has name 'Drones'.
+    # this is a bug in the CAPI data.
+    # then sort by name alphabetically.
+    stn_data['commodities'] = sorted([c for c in stn_data['market'].get('commodities', []) if c['name'] != 'Drones'], key=lambda d: d['name'])
+    return market_fingerprints.parsed(fcid, 'capi', fingerprint, stn_data, previous)
+
+
+def upstream_unavailable(error):
+    # True for errors that mean the upstream is down, rather than a problem with this carrier.
+    if isinstance(error, CapiError):
+        return error.status == 418 or error.status >= 500
+    return isinstance(error, UPSTREAM_ERRORS)
+
+
+async def get_fc_stock(fccode, source='inara'):
+    # market data is shared between ;stock, /stock and wmm via market_cache.
+    # while the upstream is unavailable the last known market is returned, with 'stale' set to when it was fetched.
+    try:
+        stn_data = await market_cache.get(fccode, source, lambda: fetch_market(fccode, source))
+    except Exception as e:
+        if not upstream_unavailable(e):
+            raise
+        stn_data = market_cache.stale(fccode, source)
+        if not stn_data:
+            raise
+        upstream_log.info("%s is unavailable for %s (%s), using last known market data.", source, fccode, e,
+                          extra={'carrier': fccode, 'source': source})
+        return stn_data
+    if not stn_data:
+        return False
+    return stn_data
+
+
+async def fetch_market(fccode, source):
+    # fetch a market from upstream, recording it in the market history, the history database and the source's stats.
+    provider = MARKET_SOURCES[source]
+    started = time.monotonic()
+    try:
+        stn_data = await provider.fetch(fccode)
+    except Exception:
+        provider.record(time.monotonic() - started, ok=False)
+        raise
+    provider.record(time.monotonic() - started, stn_data)
+    if stn_data:
+        snapshot = market_snapshots.record(fccode, source, stn_data['commodities'])
+        market_history.record(fccode, stn_data['commodities'], provider.market_time(stn_data) or snapshot.time)
+    return stn_data
+
+
+class MarketSource:
+    """
+    A provider of carrier markets, registered in MARKET_SOURCES with register_source.
+    Subclasses set `name` (the ;stock source argument) and implement fetch(), returning the market in the
+    inara format used throughout the bot, or False if the carrier has none. Upstream errors are raised.
+    The latency of each fetch and the age of the data it returned are kept as running averages.
+    Sources that set `current` have no update time for their markets, which count as current when fetched.
+    """
+    name = None
+    current = False
+
+    def __init__(self):
+        self.latency = None
+        self.age = None
+        self.ok = 0
+        self.failed = 0
+
+    def available(self, fccode):
+        # whether ;stock auto should ask this source for the carrier.
+        return True
+
+    async def fetch(self, fccode):
+        raise NotImplementedError
+
+    def market_time(self, stn_data):
+        # when the market data was current, as a timestamp.
+        return stn_data.get('stale', time.time())
+
+    def record(self, latency, stn_data=None, ok=True):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if not ok:
+            self.failed += 1
+            return
+        self.ok += 1
+        if stn_data:
+            age = max(0.0, time.time() - self.market_time(stn_data))
+            self.age = age if self.age is None else 0.8 * self.age + 0.2 * age
+
+    def usually_fresher(self, age):
+        # True if this source's data is usually newer than age seconds, or we don't know yet.
+        return self.age is None or self.age < age
+
+
+class CapiSource(MarketSource):
+    name = 'capi'
+    current = True
+
+    def available(self, fccode):
+        return 'cAPI' in FCDATA.get(fccode, {})
+
+    async def fetch(self, fccode):
+        # raises CapiError on a non-200 response.
+        return await capi_fc_market_data(fccode)
+
+
+class InaraSource(MarketSource):
+    name = 'inara'
+
+    async def fetch(self, fccode):
+        return await inara_fc_market_data(fccode)
+
+    def market_time(self, stn_data):
+        if 'stale' in stn_data:
+            return stn_data['stale']
+        updated = inara_market_time(stn_data)
+        # unknown update times count as older than any known one.
+        return updated if updated is not None else 0
+
+
+MARKET_SOURCES = {}
+
+
+def register_source(source):
+    MARKET_SOURCES[source.name] = source
+    return source
+
+
+register_source(CapiSource())
+register_source(InaraSource())
+
+
+async def race_market(fccode, deadline=STOCK_RACE_DEADLINE):
+    """
+    Ask the sources available for the carrier and return the freshest answer.
+    A source whose markets are current can't be beaten, so when there is one the others are only asked
+    if it fails, has no market or hasn't answered within `deadline` seconds. Otherwise all are asked at once.
+    Once a source has answered, the others are waited for up to `deadline` seconds from that answer,
+    and only those whose data is usually fresher than the answer we already have.
+
+    :returns: (source name, market), market is False if no source had one.
+    :rtype: tuple
+    """
+    sources = [source for source in MARKET_SOURCES.values() if source.available(fccode)]
+    waiting = [source for source in sources if not source.current]
+    if len(waiting) == len(sources):
+        waiting = []
+    tasks = {}
+
+    def start(sources):
+        started = set()
+        for source in sources:
+            task = asyncio.ensure_future(get_fc_stock(fccode, source.name))
+            # losing fetches carry on to fill the cache, don't leave their errors unretrieved.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            tasks[task] = source
+            started.add(task)
+        return started
+    pending = start([source for source in sources if source not in waiting])
+    best = None
+    error = None
+    end = None
+    while pending:
+        if best is None:
+            timeout = deadline if waiting else None
+        else:
+            timeout = max(0.0, end - time.monotonic())
+        done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            if best is None and waiting:
+                # the current source is slow, ask the others too.
+                pending |= start(waiting)
+                waiting = []
+                continue
+            break
+        for task in done:
+            source = tasks[task]
+            if task.exception() is not None:
+                error = task.exception()
+                continue
+            stn_data = task.result()
+            if stn_data and (best is None or source.market_time(stn_data) > best[0]):
+                if best is None:
+                    end = time.monotonic() + deadline
+                best = (source.market_time(stn_data), source.name, stn_data)
+        if best is None and not pending and waiting:
+            # the current source failed or had no market.
+            pending = start(waiting)
+            waiting = []
+        if best is not None:
+            age = time.time() - best[0]
+            pending = {task for task in pending if tasks[task].usually_fresher(age)}
+    if best is not None:
+        return best[1], best[2]
+    if error is not None:
+        raise error
+    return 'auto', False
@@ -0,0 +1,102 @@
+"""
+The ;stock and /stock command: market lookup and the stock table.
+"""
+
+import discord
+import asyncio
+import aiohttp
+from datetime import datetime
+from collections import OrderedDict
+
+from stockbot.capi import CapiError
+from stockbot.config import MARKET_CACHE_SIZE
+from stockbot.logs import upstream_log
+from stockbot.metrics import STOCK_TABLE_RENDERS
+from stockbot.sources import MARKET_SOURCES, get_fc_stock, race_market
+from stockbot.store import FCDATA, get_fccode
+from stockbot.upstream import CircuitOpenError
+
+
+async def stock_command(fcname, source):
+    source = source.lower()
+    fccode = fcname.upper() if fcname.upper() in FCDATA.keys() else get_fccode(fcname)
+    if fccode not in FCDATA:
+        return {'msg': 'The requested carrier is not in the list! Add carriers using the add_FC command!'}
+
+    if source != 'auto' and source not in MARKET_SOURCES:
+        names = [f'"{name}"' for name in ['auto', *MARKET_SOURCES]]
+        return {'msg': 'Invalid source! Please use %s or %s' % (', '.join(names[:-1]), names[-1])}
+    try:
+        if source == 'auto':
+            source, stn_data = await race_market(fccode)
+        else:
+            stn_data = await get_fc_stock(fccode, source)
+    except CapiError as e:
+        upstream_log.warning("Error from CAPI for %s: %s", fccode, e.status,
+                             extra={'carrier': fccode, 'source': 'capi', 'status': e.status})
+        stn_data = False
+    except CircuitOpenError as e:
+        return {'msg': f"{e.breaker.name} is currently unavailable and {FCDATA[fccode]['FCName']} has no recent market data, please try again later."}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        upstream_log.warning("Error fetching %s data for %s: %s", source, fccode, e, extra={'carrier': fccode, 'source': source})
+        stn_data = False
+
+    if stn_data is False:
+        return {'msg': f"{FCDATA[fccode]['FCName']} has no current market data."}
+
+    com_data = stn_data['commodities']
+    loc_data = stn_data['name']
+    if com_data == []:
+        return {'msg': f"{FCDATA[fccode]['FCName']} has no current market data."}
+
+    msg = "```%s```\n" % ( stock_table(fccode, source, stn_data) )
+    embed = discord.Embed()
+    embed.add_field(name = f"{FCDATA[fccode]['FCName']} ({stn_data['sName']}) stock", value = msg, inline = False)
+    embed.add_field(name = 'FC Location', value = loc_data, inline = False)
+    stale = ''
+    if 'stale' in stn_data:
+        stale = f"{source} is unavailable, showing data fetched {datetime.fromtimestamp(stn_data['stale']).strftime('%d %b %Y %H:%M')}\n"
+    embed.set_footer(text = f"Data last updated: {stn_data['market_updated']}\n"
+                            f"Data Source: {source}\n"
+                            f"{stale}"
+                            f"Numbers out of wack? Ensure EDMC is running!")
+    return {'embed': embed}
+
+
+def stock_table(fccode, source, stn_data):
+    # rendered stock table of a market, reused for as long as get_fc_stock returns the same market object.
+    key = (fccode, source)
+    cached = stock_tables.get(key)
+    if cached and cached[0] is stn_data:
+        stock_tables.move_to_end(key)
+        STOCK_TABLE_RENDERS.inc(result='cached')
+        return cached[1]
+    STOCK_TABLE_RENDERS.inc(result='rendered')
+    rows = [(com['name'], com['stock'], com['demand']) for com in stn_data['commodities'] if com['stock'] != 0 or com['demand'] != 0]
+    table = format_stock_table(rows)
+    stock_tables[key] = (stn_data, table)
+    while len(stock_tables) > MARKET_CACHE_SIZE:
+        stock_tables.popitem(last=False)
+    return table
+
+
+def format_stock_table(rows):
+    """
+    Lay out (commodity, amount, demand) rows as a fixed width table with a centered header,
+    the same as Texttable with HEADER decoration and left, right, right aligned columns.
+    """
+    header = ('Commodity', 'Amount', 'Demand')
+    rows = [(str(name), str(int(stock)), str(int(demand))) for name, stock, demand in rows]
+    widths = [max([len(title)] + [len(row[i]) for row in rows]) for i, title in enumerate(header)]
+    centered = []
+    for title, width in zip(header, widths):
+        fill = width - len(title)
+        centered.append(' ' * (fill // 2) + title + ' ' * (fill - fill // 2))
+    lines = ['   '.join(centered), '=' * (sum(widths) + 3 * (len(widths) - 1))]
+    name_width, stock_width, demand_width = widths
+    for name, stock, demand in rows:
+        lines.append(f"{name:<{name_width}}   {stock:>{stock_width}}   {demand:>{demand_width}}")
+    return '\n'.join(lines)
+
+
+stock_tables = OrderedDict()
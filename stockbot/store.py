@@ -0,0 +1,287 @@
+"""
+Tracked carriers: the sqlite store, the in-memory FCDATA and its indexes.
+"""
+
+import os
+import re
+import json
+import sqlite3
+from dotenv import find_dotenv, set_key
+
+from stockbot.config import CARRIERS, ENV_DIR, carrierdb, carrierstore
+from stockbot.logs import log, store_log
+from stockbot.util import chunk
+
+
+class CarrierListPages:
+    """
+    The sorted ;list lines split into pages, for all carriers and for wmm carriers only.
+    Built when first asked for and dropped by save_carrier and delete_carrier whenever a carrier changes.
+    """
+    def __init__(self):
+        self.pages = {}
+
+    def get(self, list_filter):
+        # (carrier count, pages) for the 'all' or 'wmm' list.
+        if list_filter not in self.pages:
+            self.pages[list_filter] = self.build(list_filter)
+        return self.pages[list_filter]
+
+    def build(self, list_filter):
+        names = []
+        for fc_code, fc_data in FCDATA.items():
+            if list_filter == 'wmm' and 'wmm' not in fc_data:
+                continue
+            owner = 'Unknown'
+            if 'owner' in fc_data:
+                if isinstance(fc_data['owner'], int):
+                    owner = "<@!%s>" % fc_data['owner']
+                else:
+                    owner = fc_data['owner']
+            cAPI = 'Disabled'
+            if 'cAPI' in fc_data:
+                if fc_data['cAPI'] == True:
+                    cAPI = 'Enabled'
+            if 'wmm' in fc_data:
+                names.append("%s (%s) Owner: %s - cAPI: %s - WMM Active" % ( fc_data['FCName'], fc_code, owner, cAPI ))
+            else:
+                names.append("%s (%s) Owner: %s - cAPI: %s" % ( fc_data['FCName'], fc_code, owner, cAPI ))
+        if not names:
+            names = ['No Fleet Carriers are being tracked, add one!']
+        carriers = sorted(names)
+        return len(carriers), list(chunk(carriers))
+
+    def invalidate(self):
+        self.pages.clear()
+
+
+carrier_list = CarrierListPages()
+
+
+def convert_carrier_data():
+    store_log.info('Attempting to convert old style carrier list, searching for data:')
+    dotenv_file = find_dotenv(os.path.join(ENV_DIR, '.env'))
+    fcfile = open(dotenv_file)
+    envlist = fcfile.readlines()
+    fcfile.close()
+
+    envlist[3] = envlist[3].strip('\n')
+    if ' ' not in envlist[3]:
+        store_log.info("old style carrier list not found in env file, skipping conversion.")
+        return {}
+    fcids = envlist[3].split('.')
+
+    envlist[4] = envlist[4].strip('\n')
+    names = envlist[4].split('.')
+
+    i = 0
+    FCDATA = {}
+
+    for carrier in fcids:
+        if carrier:
+            store_log.info("Found Carrier %s Name %s", carrier, names[i])
+            # the EDSM market id and system are no longer used, see migrate_carrier_data.
+            FCDATA[carrier.upper()] = {'FCName': names[i].lower()}
+        i = i + 1
+
+    save_carrier_data(FCDATA)
+    store_log.warning('Please remove the old style carrier list from the .env file')
+    return FCDATA
+
+
+def load_carrier_data(CARRIERS):
+    # load carriers from the carrier store, migrating the old .carriers data on first start only.
+    store_log.info('Loading Carrier Data.')
+    if not carrier_store.migrated():
+        # stores from before the marker was added were migrated if they have any carriers.
+        if carrier_store.is_empty():
+            migrate_carrier_data(CARRIERS)
+        carrier_store.set_migrated()
+    return carrier_store.load()
+
+
+def migrate_carrier_data(CARRIERS):
+    store_log.info('Carrier store is new, migrating carrier data from %s.', carrierdb)
+    try:
+        FCDATA = json.loads(CARRIERS)
+        # remove EDSM data from carrier data
+        store_log.info('Removing EDSM data from carrier data.')
+        for carrier in FCDATA:
+            FCDATA[carrier].pop('FCSys', None)
+            FCDATA[carrier].pop('FCMid', None)
+        if FCDATA:
+            save_carrier_data(FCDATA)
+    except:
+        convert_carrier_data()
+
+
+def save_carrier_data(FCDATA):
+    # rewrite every carrier in one transaction, only used when migrating. use save_carrier for changes.
+    store_log.info('Saving Carrier Data.')
+    carrier_store.save_all(FCDATA)
+
+
+def save_carrier(fccode):
+    # write a single carrier's record to the carrier store, then refresh its lookup indexes.
+    # the store is written first so a failed write leaves the indexes matching what is on disk.
+    carrier_store.save(fccode, FCDATA[fccode])
+    carrier_index.update(fccode, FCDATA[fccode])
+    carrier_list.invalidate()
+
+
+def save_carriers(fccodes):
+    # write several carriers in one transaction, then refresh their lookup indexes.
+    carrier_store.save_many({fccode: FCDATA[fccode] for fccode in fccodes})
+    for fccode in fccodes:
+        carrier_index.update(fccode, FCDATA[fccode])
+    carrier_list.invalidate()
+
+
+def delete_carrier(fccode):
+    carrier_store.delete(fccode)
+    carrier_index.remove(fccode)
+    carrier_list.invalidate()
+
+
+class CarrierIndex:
+    """
+    Lookup indexes over FCDATA: alias -> code, owner id -> codes and wmm station -> codes.
+    Owners are indexed by their discord id as an int, whether they were stored as an id or a mention.
+    Codes are kept in dicts rather than sets so iteration follows the order carriers were added.
+    Kept in step with the carrier store by save_carrier and delete_carrier.
+    """
+    def __init__(self):
+        self.alias = {}
+        self.owner = {}
+        self.wmm = {}
+        # what each carrier was last indexed under, so stale entries can be removed.
+        self.indexed = {}
+
+    def rebuild(self, fcdata):
+        self.__init__()
+        for code, data in fcdata.items():
+            self.update(code, data)
+
+    def update(self, code, data):
+        self.remove(code)
+        keys = (data['FCName'], owner_id(data.get('owner')), data.get('wmm'))
+        alias, owner, wmm = keys
+        self.alias[alias] = code
+        if owner is not None:
+            self.owner.setdefault(owner, {})[code] = None
+        if wmm is not None:
+            self.wmm.setdefault(wmm, {})[code] = None
+        self.indexed[code] = keys
+
+    def remove(self, code):
+        if code not in self.indexed:
+            return
+        alias, owner, wmm = self.indexed.pop(code)
+        if self.alias.get(alias) == code:
+            self.alias.pop(alias)
+        for index, key in ((self.owner, owner), (self.wmm, wmm)):
+            if key in index:
+                index[key].pop(code, None)
+                if not index[key]:
+                    index.pop(key)
+
+    def owned_by(self, owner):
+        return list(self.owner.get(owner_id(owner), ()))
+
+
+def owner_id(owner):
+    # discord id of a carrier owner stored as an int id or a mention, None if there is none.
+    digits = "".join(re.findall(r'\d+', str(owner or '')))
+    return int(digits) if digits else None
+
+
+carrier_index = CarrierIndex()
+
+
+class CarrierStore:
+    """
+    SQLite carrier store, one row per carrier holding its data as json.
+    Every write is its own transaction, and the database runs in WAL mode so a crash
+    mid-write never leaves a half written carrier list behind.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    @property
+    def db(self):
+        # opened on first use, so importing the bot doesn't create a database.
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS carriers (code TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            # messages posted by ChannelPages, so wmm updates can edit them after a restart.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS posted_messages (channel_id INTEGER, position INTEGER, '
+                                    'message_id INTEGER NOT NULL, content TEXT NOT NULL, PRIMARY KEY (channel_id, position))')
+        return self.connection
+
+    def migrated(self):
+        # whether the carriers from .carriers have been imported, kept as the database's user_version.
+        return self.db.execute('PRAGMA user_version').fetchone()[0] >= 1
+
+    def set_migrated(self):
+        self.db.execute('PRAGMA user_version = 1')
+
+    def is_empty(self):
+        return self.db.execute('SELECT 1 FROM carriers LIMIT 1').fetchone() is None
+
+    def load(self):
+        return {code: json.loads(data) for code, data in self.db.execute('SELECT code, data FROM carriers')}
+
+    def save(self, code, data):
+        self.db.execute('INSERT INTO carriers (code, data) VALUES (?, ?) '
+                        'ON CONFLICT (code) DO UPDATE SET data = excluded.data', (code, json.dumps(data)))
+
+    def save_many(self, carriers):
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT INTO carriers (code, data) VALUES (?, ?) '
+                                'ON CONFLICT (code) DO UPDATE SET data = excluded.data',
+                                [(code, json.dumps(data)) for code, data in carriers.items()])
+
+    def delete(self, code):
+        self.db.execute('DELETE FROM carriers WHERE code = ?', (code,))
+
+    def load_messages(self, channel_id):
+        return [(message_id, content) for message_id, content in self.db.execute(
+            'SELECT message_id, content FROM posted_messages WHERE channel_id = ? ORDER BY position', (channel_id,))]
+
+    def save_messages(self, channel_id, posted):
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.execute('DELETE FROM posted_messages WHERE channel_id = ?', (channel_id,))
+            self.db.executemany('INSERT INTO posted_messages (channel_id, position, message_id, content) VALUES (?, ?, ?, ?)',
+                                [(channel_id, position, message_id, content) for position, (message_id, content) in enumerate(posted)])
+
+    def save_all(self, fcdata):
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.execute('DELETE FROM carriers')
+            self.db.executemany('INSERT INTO carriers (code, data) VALUES (?, ?)',
+                                [(code, json.dumps(data)) for code, data in fcdata.items()])
+
+
+def save_wmm_interval(wmm_interval):
+    set_key(find_dotenv(os.path.join(ENV_DIR, '.env')), "WMM_INTERVAL", str(wmm_interval), "auto")
+    log.info("Saved WMM Update Interval: %d", wmm_interval)
+
+
+def get_fccode(fcname):
+    # TODO support ;stock command here, namely fcdata
+    return carrier_index.alias.get(fcname.lower(), False)
+
+
+carrier_store = CarrierStore(carrierstore)
+FCDATA = {}
+
+
+def load():
+    # fill FCDATA and its indexes from the carrier store, once at startup.
+    FCDATA.update(load_carrier_data(CARRIERS))
+    carrier_index.rebuild(FCDATA)
@@ -0,0 +1,172 @@
+"""
+HTTP session, rate limiters and circuit breakers for the PTN api, cAPI and inara.
+"""
+
+import asyncio
+import aiohttp
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stockbot.config import BREAKER_BACKOFF, BREAKER_MAX_BACKOFF, BREAKER_THRESHOLD, CAPI_RATE, INARA_RATE, PARSE_WORKERS
+from stockbot.logs import upstream_log
+from stockbot.metrics import UPSTREAM_REQUESTS, UPSTREAM_REQUEST_SECONDS
+
+
+async def api_get(url, params):
+    # GET from the PTN api, returns (status, json) or (status, text) if the body is not json.
+    session = await get_http_session()
+    async with session.get(url, params=params) as r:
+        try:
+            data = await r.json(content_type=None)
+        except ValueError:
+            data = await r.text()
+        return r.status, data
+
+
+async def api_post(url, params, body):
+    # POST json to the PTN api, returns (status, json) or (status, text) like api_get.
+    session = await get_http_session()
+    async with session.post(url, params=params, json=body) as r:
+        try:
+            data = await r.json(content_type=None)
+        except ValueError:
+            data = await r.text()
+        return r.status, data
+
+
+class RateLimiter:
+    """
+    Spaces out requests to an upstream so that no more than `rate` start every second.
+    A rate of 0 disables limiting.
+    """
+    def __init__(self, rate):
+        self.set_rate(rate)
+        self.next_slot = 0
+        self.lock = asyncio.Lock()
+
+    def set_rate(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker):
+        super().__init__(f"{breaker.name} circuit is open, retrying in {breaker.retry_in():.0f}s")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    """
+    Gives a failing upstream a rest. After `threshold` consecutive failures the circuit opens and
+    calls fail fast with CircuitOpenError. Once the backoff has passed a single probe call is let
+    through (half-open): success closes the circuit, failure re-opens it with double the backoff,
+    up to `max_backoff` seconds.
+    """
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, backoff=BREAKER_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.name = name
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.state = 'closed'
+        self.failures = 0
+        self.total_failures = 0
+        self.retry_at = 0
+        self.probing = False
+        self.last_error = None
+
+    def retry_in(self):
+        return max(0, self.retry_at - time.monotonic())
+
+    def allow(self):
+        if self.state == 'open' and time.monotonic() >= self.retry_at:
+            self.state = 'half-open'
+        if self.state == 'half-open':
+            if self.probing:
+                return False
+            self.probing = True
+        return self.state != 'open'
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.backoff = self.base_backoff
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.total_failures += 1
+        self.last_error = str(error)
+        if self.state == 'half-open':
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self.open()
+        elif self.state == 'closed' and self.failures >= self.threshold:
+            self.open()
+
+    def open(self):
+        upstream_log.warning("%s circuit opened after %d failures, retrying in %ds. Last error: %s",
+                             self.name, self.failures, self.backoff, self.last_error, extra={'source': self.name})
+        self.state = 'open'
+        self.retry_at = time.monotonic() + self.backoff
+
+    async def call(self, request, failed=None):
+        """
+        Await request() through the breaker. Connection errors and timeouts count as failures,
+        as do responses for which failed(response) is True; those responses are still returned.
+        """
+        if not self.allow():
+            UPSTREAM_REQUESTS.inc(upstream=self.name, result='rejected')
+            raise CircuitOpenError(self)
+        probe = self.state == 'half-open'
+        started = time.monotonic()
+        try:
+            response = await request()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.record_failure(e)
+            UPSTREAM_REQUESTS.inc(upstream=self.name, result='error')
+            raise
+        finally:
+            UPSTREAM_REQUEST_SECONDS.observe(time.monotonic() - started, upstream=self.name)
+            if probe:
+                self.probing = False
+        if failed and failed(response):
+            self.record_failure(f"status {response[0]}")
+            UPSTREAM_REQUESTS.inc(upstream=self.name, result='error')
+        else:
+            self.record_success()
+            UPSTREAM_REQUESTS.inc(upstream=self.name, result='ok')
+        return response
+
+
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError)
+capi_breaker = CircuitBreaker('cAPI')
+oauth_breaker = CircuitBreaker('cAPI auth')
+inara_breaker = CircuitBreaker('Inara')
+capi_limiter = RateLimiter(CAPI_RATE)
+inara_limiter = RateLimiter(INARA_RATE)
+
+
+http_session = None
+
+
+async def get_http_session():
+    # one keep-alive session shared by every upstream fetch, created on first use.
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(headers={'User-Agent': 'PTNStockBot'},
+                                             timeout=aiohttp.ClientTimeout(total=30))
+    return http_session
+
+
+async def run_blocking(func, *args):
+    # run cpu heavy work such as html parsing in the parse thread pool, keeping the event loop free.
+    return await asyncio.get_running_loop().run_in_executor(parse_executor, func, *args)
+
+
+parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='parse')
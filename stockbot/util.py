@@ -0,0 +1,23 @@
+"""
+Small helpers shared by the rest of the bot.
+"""
+
+
+def format_hours(hours):
+    # rough human readable duration, e.g. ~40m, ~3h or ~2d.
+    if hours < 1:
+        return "~%dm" % max(1, round(hours * 60))
+    if hours < 48:
+        return "~%dh" % round(hours)
+    return "~%dd" % round(hours / 24)
+
+
+def chunk(chunk_list, max_size=10):
+    """
+    Take an input list, and an expected max_size.
+
+    :returns: A chunked list that is yielded back to the caller
+    :rtype: iterator
+    """
+    for i in range(0, len(chunk_list), max_size):
+        yield chunk_list[i:i + max_size]
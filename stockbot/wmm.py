@@ -0,0 +1,497 @@
+"""
+The wmm-stock update: scheduling carrier refreshes and rendering the channels.
+"""
+
+import asyncio
+import heapq
+import math
+import time
+from datetime import datetime
+from collections import namedtuple
+
+from stockbot import config
+from stockbot.capi import CapiError, capi_client
+from stockbot.channels import owner_notifier
+from stockbot.config import WMM_CONCURRENCY, WMM_EMPTY_ALERT_HOURS, WMM_FORECAST_HOURS, WMM_RENDER_DELAY
+from stockbot.inara import inara_market_time
+from stockbot.logs import wmm_log
+from stockbot.markets import market_cache, market_snapshots
+from stockbot.metrics import CARRIER_FETCH_SECONDS, WMM_CARRIERS, WMM_CARRIERS_PROCESSED, WMM_CYCLE_SECONDS, WMM_REFRESHED_CARRIERS, WMM_RENDERS_SKIPPED
+from stockbot.sources import get_fc_stock
+from stockbot.store import FCDATA, carrier_index, save_carrier
+from stockbot.upstream import UPSTREAM_ERRORS, capi_breaker
+from stockbot.util import chunk, format_hours
+from stockbot.workers import worker_pool
+
+
+async def render_wmm(wmm_pages, cco_pages, results):
+    # update the wmm and cco channels from the latest fetch result of each tracked carrier.
+    wmm_systems = list(carrier_index.wmm)
+
+    if wmm_systems == []:
+        nofc = "WMM Stock: No Fleet Carriers are currently being tracked for WMM. Please add some to the list!"
+        await wmm_pages.render([nofc])
+        return
+
+    wmm_ids = [market_snapshots.intern(commodity) for commodity in WMM_COMMODITIES]
+    forecasts = market_snapshots.forecast([result['fcid'] for result in results if result['source']], wmm_ids, WMM_FORECAST_HOURS * 3600)
+
+    wmm_carriers_by_station, station_totals = aggregate_wmm(results, forecasts)
+
+    content = {}
+    for system in wmm_systems:
+        content[system] = ['-']
+        carriers = wmm_carriers_by_station.get(system)
+        if not carriers:
+            content[system].append("Could not find any carriers with stock in %s" % system)
+            continue
+        for carrier in carriers:
+            if not carrier.has_market:
+                content[system].append("**%s** - %s (%s) has no current market data. please visit the carrier with EDMC running" % (
+                    carrier.name, carrier.system, carrier.station )
+                )
+                continue
+            for com in carrier.commodities:
+                empty_in = f", empty in {format_hours(com.hours_left)}" if com.hours_left is not None else ''
+                low = " - LOW STOCK" if com.low else ''
+                content[system].append("%s x %s - %s (%s) - **%s** - Price: %s%s%s %s" % (
+                    com.name, format(com.stock, ','), carrier.system, carrier.station, carrier.name, format(com.price, ','), low, empty_in, carrier.market_updated )
+                )
+                if com.low:
+                    notify_low_stock(carrier, com, empty_in)
+            if not carrier.commodities:
+                content[system].append("**%s** - %s (%s) has no stock of any WMM commodity! %s" % (
+                    carrier.name, carrier.system, carrier.station, carrier.market_updated )
+                )
+
+    try:
+        wmm_updated = "<t:%d:R>" % datetime.now().timestamp()
+    except:
+        wmm_updated = datetime.now().strftime("%d %b %Y %H:%M:%S")
+        pass
+
+    # for each station, use a new message.
+    # and split messages over 10 lines.
+    # each line is between 120-200 chars
+    # using max: 2000 / 200 = 10
+    wmm_messages = []
+    for (system, stncontent) in content.items():
+        if len(stncontent) == 1:
+            # this station has no carriers, dont bother printing it.
+            continue
+        for page in chunk(stncontent, 10):
+            page.insert(0, ':')
+            wmm_messages.append('\n'.join(page))
+
+    footer = []
+    footer.append(':')
+    footer.append("-\nCarrier stocks last checked %s" % ( wmm_updated ))
+    footer.append("Carriers with no timestamp are fetched from cAPI and are accurate to within an hour.")
+    footer.append("Carriers with (As of ...) are fetched from Inara. Ensure EDMC is running to update stock levels!")
+    if any(result['status'] == 418 for result in results) or capi_breaker.state != 'closed':
+        footer.append("Bleep Bloop: Frontier API is currently unavailable, cAPI carriers show their last known stock or Inara data.")
+    wmm_messages.append('\n'.join(footer))
+    await wmm_pages.render(wmm_messages)
+
+    ccocontent = {}
+    for system in station_totals:
+        ccocontent[system] = []
+        for station, totals in station_totals[system].items():
+            ccocontent[system].append('-')
+            for commodity, commodity_id in zip(WMM_COMMODITIES, wmm_ids):
+                if commodity_id not in totals:
+                    ccocontent[system].append(f"{commodity.title()} x NO STOCK !! - {system} ({station})")
+                else:
+                    ccocontent[system].append(f"{commodity.title()} x {format(totals[commodity_id], ',')} - {system} ({station})")
+
+    # for each station, use a new message.
+    # and split messages over 10 lines.
+    # each line is roughly 50 chars
+    # using max: 2000 / 50 = 40
+    cco_messages = []
+    for (system, stncontent) in ccocontent.items():
+        if len(stncontent) == 1:
+            # this station has no carriers, dont bother printing it.
+            continue
+        for page in chunk(stncontent, 40):
+            page.insert(0, ':')
+            cco_messages.append('\n'.join(page))
+    await cco_pages.render(cco_messages)
+
+    WMM_CARRIERS.set(len(results))
+
+
+def notify_low_stock(carrier, com, empty_in):
+    # Notify the owner once per commodity per wmm_tracking session, in the owner's next digest.
+    fcid = carrier.fcid
+    if 'notified' not in FCDATA[fcid]:
+        # catch wmm objects created before this update.
+        FCDATA[fcid]['notified'] = {}
+    if com.name in FCDATA[fcid]['notified']:
+        return
+    message = "Your Fleet Carrier **%s** is low on %s - %s remaining%s" % (
+            carrier.name, com.name, com.stock, empty_in )
+    owner_notifier.queue(fcid, com.name, message, notified=com.name)
+
+
+WMM_COMMODITIES = ('indite', 'bertrandite', 'gold', 'silver')
+WmmCarrier = namedtuple('WmmCarrier', ['fcid', 'name', 'system', 'station', 'market_updated', 'has_market', 'commodities'])
+WmmCommodity = namedtuple('WmmCommodity', ['name', 'stock', 'price', 'hours_left', 'low'])
+
+
+def aggregate_wmm(results, forecasts):
+    """
+    Group fetched WMM carriers by the station they supply, and total their WMM commodity stock
+    per system and station. Rows of other commodities are skipped before any other work is done.
+
+    :param results: fetch_wmm_carrier results, in the order the carriers should be listed.
+    :param forecasts: hours until empty by (carrier code, commodity id), from MarketSnapshots.forecast.
+    :returns: (carriers, totals): WMM station -> list of WmmCarrier, and
+              system -> WMM station -> commodity id -> total stock.
+    :rtype: tuple
+    """
+    wmm_ids = {commodity: market_snapshots.intern(commodity) for commodity in WMM_COMMODITIES}
+    carriers = {}
+    totals = {}
+    for result in results:
+        fcid = result['fcid']
+        if not result['source'] or fcid not in FCDATA or 'wmm' not in FCDATA[fcid]:
+            # fetch failed (the reason has already been logged), or carrier was removed or untracked while fetching.
+            continue
+        stn_data = result['data']
+        station = FCDATA[fcid]['wmm']
+        system = stn_data['currentStarSystem']
+        commodities = []
+        if stn_data['commodities']:
+            station_totals = totals.setdefault(system, {}).setdefault(station, {})
+            for com in stn_data['commodities']:
+                commodity_id = wmm_ids.get(com['name'].lower())
+                if commodity_id is None or not com['stock']:
+                    continue
+                stock = int(com['stock'])
+                station_totals[commodity_id] = station_totals.get(commodity_id, 0) + stock
+                # low when the carrier is forecast to run out soon, or below 1000 until there's enough history to tell.
+                hours_left = forecasts.get((fcid, commodity_id))
+                low = hours_left < WMM_EMPTY_ALERT_HOURS if hours_left is not None else stock < 1000
+                commodities.append(WmmCommodity(com['name'], stock, com['buyPrice'], hours_left, low))
+        carriers.setdefault(station, []).append(WmmCarrier(
+            fcid, stn_data['full_name'], system, station, wmm_market_updated(result), bool(stn_data['commodities']), commodities))
+    return carriers, totals
+
+
+def wmm_market_updated(result):
+    # how old a carrier's market is, shown after each of its lines.
+    stn_data = result['data']
+    if result['source'] == 'capi':
+        if 'stale' in stn_data:
+            return "(cAPI unavailable, as of <t:%d:R>)" % stn_data['stale']
+        return ''
+    updated = inara_market_time(stn_data)
+    if updated is None:
+        return "(As of %s)" % stn_data['market_updated']
+    return "(As of <t:%d:R>)" % updated
+
+
+class WmmScheduler:
+    """
+    Refreshes each WMM carrier on its own schedule, kept in a priority queue of (due time, carrier code).
+    Carriers that are low or selling are refreshed more often than stable ones, see next_refresh().
+    The channels are re-rendered WMM_RENDER_DELAY seconds after a refresh, so a burst of refreshes
+    results in one update of the changed pages.
+    """
+    def __init__(self):
+        self.queue = []
+        # carrier code -> due time, None while it's being refreshed.
+        self.due = {}
+        self.results = {}
+        self.failures = {}
+        self.changed = {}
+        self.dirty = None
+        self.wakeup = None
+        self.tasks = []
+
+    async def start(self, wmm_pages, cco_pages):
+        # a task that is still running after the other one failed would otherwise keep rendering to the old pages.
+        await self.stop()
+        worker_pool.start()
+        self.wakeup = asyncio.Event()
+        self.dirty = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.refresh_loop()), asyncio.create_task(self.render_loop(wmm_pages, cco_pages))]
+        for task in self.tasks:
+            task.add_done_callback(self.stopped)
+
+    def stopped(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            wmm_log.error("wmm scheduler task has failed.", exc_info=task.exception())
+
+    def is_running(self):
+        return bool(self.tasks) and not any(task.done() for task in self.tasks)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await worker_pool.stop()
+
+    def wake(self):
+        # have refresh_loop look at the queue and tracked carriers again now.
+        if self.wakeup:
+            self.wakeup.set()
+
+    def schedule(self, fcid, delay):
+        due = time.time() + delay
+        self.due[fcid] = due
+        heapq.heappush(self.queue, (due, fcid))
+
+    def next_due(self):
+        # seconds until the next carrier is due, None if nothing is scheduled.
+        while self.queue and self.due.get(self.queue[0][1]) != self.queue[0][0]:
+            # rescheduled or no longer tracked.
+            heapq.heappop(self.queue)
+        return max(0.0, self.queue[0][0] - time.time()) if self.queue else None
+
+    def pop_due(self):
+        fcids = []
+        while self.next_due() == 0:
+            due, fcid = heapq.heappop(self.queue)
+            self.due[fcid] = None
+            fcids.append(fcid)
+        return fcids
+
+    def sync(self):
+        # schedule newly tracked carriers straight away, forget untracked ones.
+        tracked = {fcid for system in carrier_index.wmm for fcid in carrier_index.wmm[system]}
+        for fcid in tracked.difference(self.due):
+            self.schedule(fcid, 0)
+        for fcid in set(self.due).difference(tracked):
+            del self.due[fcid]
+            self.failures.pop(fcid, None)
+            self.changed.pop(fcid, None)
+            if self.results.pop(fcid, None):
+                self.dirty.set()
+
+    def trigger(self, fcids=None):
+        # refresh the given carriers, or every tracked carrier, now.
+        for fcid in list(self.due if fcids is None else fcids):
+            if self.due.get(fcid) is not None:
+                self.schedule(fcid, 0)
+        self.wake()
+
+    def interval_changed(self, old, new):
+        # scale the time left for every carrier, so a new wmm_interval applies straight away.
+        now = time.time()
+        for fcid, due in list(self.due.items()):
+            if due is not None:
+                self.schedule(fcid, max(0.0, due - now) * new / old)
+        self.wake()
+
+    async def refresh_loop(self):
+        started = True
+        while True:
+            self.sync()
+            fcids = self.pop_due()
+            if fcids:
+                await self.refresh(fcids)
+                continue
+            if started:
+                # render once the carriers due at startup are refreshed, even if nothing is tracked.
+                started = False
+                self.dirty.set()
+            # sleep until the next carrier is due, or a trigger, interval or tracking change wakes us.
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.next_due())
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh(self, fcids):
+        started = time.monotonic()
+        results = await fetch_wmm_stock(fcids)
+        WMM_CYCLE_SECONDS.observe(time.monotonic() - started)
+        changed = unchanged = failed = 0
+        for result in results:
+            fcid = result['fcid']
+            WMM_CARRIERS_PROCESSED.inc(source=result['source'] or 'failed')
+            if result['reauth'] and fcid in FCDATA:
+                # User needs to re-auth. (400 = EGS, 401 = Expired Token)
+                FCDATA[fcid].pop('cAPI', None)
+                save_carrier(fcid)
+                message = (f'I was unable to retrieve your carrier stock levels for "{FCDATA[fcid]["FCName"]} ({fcid})" from the cAPI, please re-authenticate '
+                            f'using the `;capi_enable {FCDATA[fcid]["FCName"]}` command. Stocks will be fetched from Inara until this has been completed.')
+                owner_notifier.queue(fcid, 'reauth', message)
+            if fcid not in self.due:
+                # untracked while fetching.
+                continue
+            previous = self.results.get(fcid)
+            if not result['source']:
+                failed += 1
+            elif previous and result['source'] == previous['source'] and result['data'] is previous['data']:
+                # same market object as last time: served from cache, or the upstream response didn't change.
+                unchanged += 1
+            else:
+                changed += 1
+            if result['source'] or not previous:
+                # keep showing the last market we got if this refresh failed.
+                self.results[fcid] = result
+            self.schedule(fcid, self.next_refresh(fcid, result))
+        WMM_REFRESHED_CARRIERS.inc(changed, result='changed')
+        WMM_REFRESHED_CARRIERS.inc(unchanged, result='unchanged')
+        WMM_REFRESHED_CARRIERS.inc(failed, result='failed')
+        wmm_log.info("Refreshed %d carriers: %d changed, %d unchanged, %d failed", len(results), changed, unchanged, failed,
+                     extra={'duration': round(time.monotonic() - started, 3)})
+        # send re-auth requests now, and retry undelivered alerts when the channels don't need a render.
+        owner_notifier.flush_soon()
+        if changed:
+            self.dirty.set()
+        else:
+            # nothing new to show, leave the channels alone.
+            WMM_RENDERS_SKIPPED.inc()
+
+    def next_refresh(self, fcid, result):
+        """
+        Seconds until a carrier should be refreshed again: a quarter of wmm_interval while it's low on a
+        WMM commodity, half while its stock is changing and double once it's stable.
+        Failed refreshes are retried sooner, backing off up to wmm_interval.
+        """
+        now = time.time()
+        if not result['source']:
+            failures = self.failures[fcid] = self.failures.get(fcid, 0) + 1
+            return min(config.wmm_interval, 60 * 2 ** failures)
+        self.failures.pop(fcid, None)
+
+        wmm_ids = [market_snapshots.intern(commodity) for commodity in WMM_COMMODITIES]
+        history = market_snapshots.history(fcid)[-2:]
+        forecasts = market_snapshots.forecast([fcid], wmm_ids, WMM_FORECAST_HOURS * 3600, now)
+        low = any(hours_left < WMM_EMPTY_ALERT_HOURS for hours_left in forecasts.values()) or any(
+            history and 0 < (history[-1].get(commodity_id) or 0) < 1000 for commodity_id in wmm_ids)
+        changing = len(history) == 2 and any(history[0].get(commodity_id) != history[1].get(commodity_id) for commodity_id in wmm_ids)
+        if history and (changing or fcid not in self.changed):
+            self.changed[fcid] = history[-1].time
+
+        if low:
+            delay = config.wmm_interval / 4
+        elif changing:
+            delay = config.wmm_interval / 2
+        elif len(history) == 2:
+            delay = config.wmm_interval * 2
+        else:
+            delay = config.wmm_interval
+        if result['source'] == 'capi' and fcid in self.changed and 'stale' not in result['data']:
+            # cAPI markets only update about once an hour, refresh just after an update rather than in between.
+            since_change = now + delay - self.changed[fcid] - CAPI_UPDATE_MARGIN
+            cycles = max(1, math.ceil(since_change / CAPI_UPDATE_CYCLE))
+            delay = self.changed[fcid] + cycles * CAPI_UPDATE_CYCLE + CAPI_UPDATE_MARGIN - now
+        return max(delay, 60)
+
+    def ordered_results(self):
+        # latest result of each tracked carrier, in wmm system order.
+        return [self.results[fcid] for system in carrier_index.wmm for fcid in carrier_index.wmm[system] if fcid in self.results]
+
+    async def render_loop(self, wmm_pages, cco_pages):
+        while True:
+            await self.dirty.wait()
+            await asyncio.sleep(WMM_RENDER_DELAY)
+            self.dirty.clear()
+            try:
+                await render_wmm(wmm_pages, cco_pages, self.ordered_results())
+            except Exception:
+                wmm_log.exception("Failed to update the wmm channels")
+            # one digest per owner for the low stock alerts of this update.
+            owner_notifier.flush_soon()
+
+
+CAPI_UPDATE_CYCLE = 3600
+CAPI_UPDATE_MARGIN = 120
+wmm_scheduler = WmmScheduler()
+
+
+async def fetch_wmm_carrier(fcid, semaphore):
+    """
+    Fetch the market of a single WMM carrier, using cAPI if enabled with an Inara fallback.
+
+    :returns: dict with the carrier id, the source used (None on failure), the last cAPI status,
+              the station data and whether the owner needs to re-authenticate with cAPI.
+    :rtype: dict
+    """
+    result = {'fcid': fcid, 'source': None, 'status': None, 'data': None, 'reauth': False}
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            await fetch_wmm_carrier_market(fcid, result)
+        except Exception:
+            # don't let one carrier break the refresh of the others.
+            wmm_log.exception("Failed to fetch carrier %s", fcid, extra={'carrier': fcid})
+            result.update(source=None, data=None)
+        finally:
+            duration = time.monotonic() - started
+            CARRIER_FETCH_SECONDS.set(duration, carrier=fcid)
+            wmm_log.debug("Fetched carrier %s", fcid, extra={'carrier': fcid, 'source': result['source'], 'duration': round(duration, 3),
+                                                             'status': result['status'], 'sample': True})
+    return result
+
+
+async def fetch_wmm_carrier_market(fcid, result):
+    # fills in result for fetch_wmm_carrier, returning early once a source has been settled on.
+    if 'cAPI' in FCDATA[fcid]:
+        wmm_log.debug("Calling CApi for carrier %s", fcid, extra={'carrier': fcid, 'source': 'capi', 'sample': True})
+        try:
+            stn_data = await get_fc_stock(fcid, 'capi')
+            status = 200
+        except CapiError as e:
+            status, stn_data = e.status, e.data
+        except UPSTREAM_ERRORS as e:
+            status, stn_data = None, e
+        result['status'] = status
+
+        wmm_log.debug("capi response for %s: %s", fcid, status, extra={'carrier': fcid, 'source': 'capi', 'status': status, 'sample': True})
+        if status == 200:
+            if not stn_data:
+                # already logged by capi_fc_market_data
+                return result
+            result['source'] = 'capi'
+            result['data'] = stn_data
+            return result
+        # TODO handle missing carriers, auth errors etc.
+        wmm_log.warning("Error from CAPI for %s: %s - %s", fcid, status, stn_data, extra={'carrier': fcid, 'source': 'capi', 'status': status})
+        if status == 500:
+            # this is an internal stockbot api error, dont re-auth for this.
+            wmm_log.error("Internal stockbot API error, someone check the logs")
+            return result
+        elif status == 418 or isinstance(stn_data, UPSTREAM_ERRORS):
+            # capi is down or unreachable and we have no last known market, fall back to inara.
+            pass
+        elif status == 400 or status == 401:
+            # fall through to inara, the caller asks the owner to re-auth.
+            result['reauth'] = True
+        else:
+            # all other unknown errors.
+            wmm_log.warning("Unknown error from CAPI for %s, see above for details.", fcid)
+            return result
+
+    try:
+        stn_data = await get_fc_stock(fcid, 'inara')
+    except UPSTREAM_ERRORS as e:
+        wmm_log.warning("inara is unavailable for %s: %s", fcid, e, extra={'carrier': fcid, 'source': 'inara'})
+        return result
+    if not stn_data:
+        wmm_log.info("no inara market data for %s", fcid, extra={'carrier': fcid, 'source': 'inara'})
+        return result
+    result['source'] = 'inara'
+    result['data'] = stn_data
+    return result
+
+
+async def fetch_wmm_stock(wmm_carriers):
+    """
+    Fetch the markets of all given carriers concurrently, at most WMM_CONCURRENCY at a time.
+
+    :returns: A list of fetch_wmm_carrier results, in the same order as wmm_carriers
+    :rtype: list
+    """
+    if worker_pool.processes:
+        return await worker_pool.fetch(wmm_carriers)
+    # ask the cAPI proxy for all the cAPI carriers that need fetching at once, each carrier picks up its response when it runs.
+    capi_client.prefetch([fcid for fcid in wmm_carriers if 'cAPI' in FCDATA.get(fcid, {}) and not market_cache.fresh(fcid, 'capi')])
+    semaphore = asyncio.Semaphore(WMM_CONCURRENCY)
+    return await asyncio.gather(*[fetch_wmm_carrier(fcid, semaphore) for fcid in wmm_carriers])
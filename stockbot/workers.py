@@ -0,0 +1,270 @@
+"""
+Optional worker processes for the wmm update, see WorkerPool.
+"""
+
+import signal
+import asyncio
+import zlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from stockbot import upstream
+from stockbot.config import CAPI_RATE, INARA_RATE, WMM_WORKERS
+from stockbot.history import market_history
+from stockbot.logs import setup_logging, wmm_log
+from stockbot.markets import market_cache, market_snapshots
+from stockbot.metrics import WMM_WORKER_STARTS
+from stockbot.sources import MARKET_SOURCES
+from stockbot.store import FCDATA
+from stockbot.upstream import capi_limiter, inara_limiter
+
+
+# the parts of a market the bot uses once it has been fetched, everything else stays in the worker.
+MARKET_KEYS = ('name', 'currentStarSystem', 'full_name', 'sName', 'market_updated', 'stale')
+COMMODITY_KEYS = ('name', 'stock', 'demand', 'buyPrice', 'sellPrice')
+
+
+class WorkerPool:
+    """
+    Worker processes that fetch and parse the markets of the wmm carriers, so the parsing of a large fleet
+    is spread over several cores instead of sharing the bot's GIL.
+    Every worker owns a fixed shard of the carriers (by a hash of the carrier code), with its own http session,
+    market cache, response fingerprints and an equal share of the upstream request rates.
+    Markets are sent back without the parts the bot doesn't use, and a market that hasn't changed since the
+    worker last sent it is sent as a flag only. Workers that die are started again on the next fetch,
+    the carriers they were fetching count as failed refreshes.
+    Each worker's pipe is read on a thread of its own, so a large or partly written reply never blocks the event loop.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        # worker index -> (process, pipe)
+        self.workers = {}
+        # worker index -> future set once the worker has started and is waiting for carriers.
+        self.ready = {}
+        # worker index -> task reading the worker's pipe.
+        self.readers = {}
+        # job id -> (worker index, future for the worker's results)
+        self.jobs = {}
+        # carrier code -> (source, market) last received, for the markets sent as unchanged.
+        self.markets = {}
+        self.job_ids = count()
+
+    def shard(self, fcid):
+        return zlib.crc32(fcid.encode()) % self.processes
+
+    def start(self):
+        # start the workers that aren't running, e.g. after one has died.
+        for index in range(self.processes):
+            if index not in self.workers:
+                self.start_worker(index)
+
+    async def wait_ready(self):
+        # wait until every worker has imported the bot and is waiting for carriers, e.g. before timing a fetch.
+        await asyncio.gather(*self.ready.values())
+
+    def start_worker(self, index):
+        # spawn rather than fork, the bot process has an event loop and threads running.
+        context = multiprocessing.get_context('spawn')
+        conn, worker_conn = context.Pipe()
+        process = context.Process(target=worker_main, args=(worker_conn, index, self.processes),
+                                  name=f'stockbot-wmm-worker-{index}', daemon=True)
+        process.start()
+        worker_conn.close()
+        loop = asyncio.get_running_loop()
+        self.workers[index] = (process, conn)
+        self.ready[index] = loop.create_future()
+        self.readers[index] = asyncio.create_task(self.receive(index, process, conn))
+        WMM_WORKER_STARTS.inc(worker=index)
+        wmm_log.info("Started wmm worker %d (pid %d)", index, process.pid)
+
+    async def receive(self, index, process, conn):
+        # read a worker's replies until its pipe closes, blocking a thread of its own rather than the event loop.
+        loop = asyncio.get_running_loop()
+        thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'wmm-worker-{index}-reader')
+        try:
+            while True:
+                try:
+                    message = await loop.run_in_executor(thread, conn.recv)
+                except (EOFError, OSError):
+                    break
+                if message[0] == 'ready':
+                    if not self.ready[index].done():
+                        self.ready[index].set_result(None)
+                    continue
+                kind, job_id, results = message
+                worker, future = self.jobs.pop(job_id, (None, None))
+                if future is not None and not future.done():
+                    future.set_result(results)
+        finally:
+            conn.close()
+            thread.shutdown(wait=False)
+        if self.workers.get(index, (None,))[0] is process:
+            # not stopped by us.
+            self.worker_died(index)
+
+    def worker_died(self, index):
+        process, conn = self.close_worker(index)
+        process.join(0.1)
+        wmm_log.error("wmm worker %d (pid %d) has died with exit code %s, it will be restarted on the next refresh",
+                      index, process.pid, process.exitcode)
+        self.fail_jobs(index)
+
+    def close_worker(self, index):
+        process, conn = self.workers.pop(index)
+        ready = self.ready.pop(index)
+        if not ready.done():
+            ready.set_result(None)
+        self.readers.pop(index, None)
+        try:
+            # the worker stops, which closes the pipe for its reader.
+            conn.send(('stop',))
+        except (BrokenPipeError, OSError):
+            pass
+        return process, conn
+
+    def fail_jobs(self, index=None):
+        for job_id, (worker, future) in list(self.jobs.items()):
+            if index is None or worker == index:
+                del self.jobs[job_id]
+                if not future.done():
+                    future.set_result(None)
+
+    def send(self, index, message):
+        try:
+            self.workers[index][1].send(message)
+        except (BrokenPipeError, OSError):
+            self.worker_died(index)
+            return False
+        return True
+
+    async def fetch(self, fcids):
+        """
+        Fetch the markets of the given carriers in the workers, starting any that aren't running.
+
+        :returns: A list of fetch_wmm_carrier results, in the same order as fcids
+        :rtype: list
+        """
+        self.start()
+        shards = {}
+        for fcid in fcids:
+            shards.setdefault(self.shard(fcid), {})[fcid] = FCDATA.get(fcid, {})
+        loop = asyncio.get_running_loop()
+        futures = []
+        for index, carriers in shards.items():
+            job_id = next(self.job_ids)
+            future = loop.create_future()
+            self.jobs[job_id] = (index, future)
+            futures.append(future)
+            # the carriers whose market we have, the worker resends the others in full.
+            known = [fcid for fcid in carriers if fcid in self.markets]
+            self.send(index, ('fetch', job_id, carriers, known))
+        received = {}
+        for results in await asyncio.gather(*futures):
+            for result in results or []:
+                received[result['fcid']] = self.received(result)
+        return [received.get(fcid) or {'fcid': fcid, 'source': None, 'status': None, 'data': None, 'reauth': False} for fcid in fcids]
+
+    def received(self, result):
+        # turn a worker's compact result back into a fetch_wmm_carrier result, caching and recording its market.
+        fcid, source = result['fcid'], result['source']
+        unchanged, fetched = result.pop('unchanged'), result.pop('fetched')
+        if not source:
+            return result
+        if unchanged:
+            if fcid not in self.markets:
+                # forgotten since the worker was asked, e.g. the pool was stopped. retried like a failed fetch.
+                return dict(result, source=None, data=None)
+            # the same market object as last time, so the scheduler sees it hasn't changed.
+            result['data'] = self.markets[fcid][1]
+        else:
+            self.markets[fcid] = (source, result['data'])
+        if fetched:
+            # the worker fetched it from upstream rather than its cache, share it with ;stock and the market histories.
+            market_snapshots.record(fcid, source, result['data']['commodities'], fetched=fetched)
+            market_history.record(fcid, result['data']['commodities'], MARKET_SOURCES[source].market_time(result['data']) or fetched)
+            if 'stale' not in result['data']:
+                market_cache.put(fcid, source, result['data'])
+        return result
+
+    async def stop(self):
+        loop = asyncio.get_running_loop()
+        readers = list(self.readers.values())
+        for index in list(self.workers):
+            process, conn = self.close_worker(index)
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        await asyncio.gather(*readers, return_exceptions=True)
+        self.fail_jobs()
+        self.markets.clear()
+
+
+worker_pool = WorkerPool(WMM_WORKERS)
+
+
+def worker_main(conn, index, processes):
+    # entry point of a worker process, fetching the carriers sent by the bot until it closes the pipe.
+    # the bot stops its workers, don't let ctrl-c interrupt them half way through a reply.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the log file belongs to the bot process.
+    setup_logging(log_file='')
+    # fetch in this process, not in workers of its own.
+    worker_pool.processes = 0
+    capi_limiter.set_rate(CAPI_RATE / processes)
+    inara_limiter.set_rate(INARA_RATE / processes)
+    asyncio.run(serve(conn))
+
+
+async def serve(conn):
+    # wmm imports the worker pool, so it's only imported here in the worker process.
+    from stockbot.wmm import fetch_wmm_stock
+    loop = asyncio.get_running_loop()
+    sent = {}
+    conn.send(('ready',))
+    try:
+        while True:
+            try:
+                message = await loop.run_in_executor(None, conn.recv)
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+            kind, job_id, carriers, known = message
+            FCDATA.update(carriers)
+            for fcid in set(carriers).difference(known):
+                sent.pop(fcid, None)
+            latest = {fcid: market_snapshots.latest(fcid) for fcid in carriers}
+            results = await fetch_wmm_stock(list(carriers))
+            conn.send(('results', job_id, [compact_result(result, sent, latest[result['fcid']]) for result in results]))
+    finally:
+        if upstream.http_session is not None:
+            await upstream.http_session.close()
+
+
+def compact_result(result, sent, latest):
+    """
+    A fetch_wmm_carrier result as sent to the bot: the market without the parts the bot doesn't use, or
+    no market at all if it's the same market object that was sent last time.
+
+    :param sent: carrier code -> (source, market) last sent, updated here.
+    :param latest: the carrier's latest market snapshot before fetching, to tell fetches from cache hits.
+    :returns: the result, with 'unchanged' and 'fetched' (the snapshot time of a fresh fetch, or None) added.
+    :rtype: dict
+    """
+    fcid, source, stn_data = result['fcid'], result['source'], result['data']
+    compact = dict(result, data=None, unchanged=False, fetched=None)
+    if not source:
+        return compact
+    snapshot = market_snapshots.latest(fcid)
+    if snapshot is not latest:
+        compact['fetched'] = snapshot.time
+    previous = sent.get(fcid)
+    if previous and previous[0] == source and previous[1] is stn_data:
+        compact['unchanged'] = True
+        return compact
+    sent[fcid] = (source, stn_data)
+    market = {key: stn_data[key] for key in MARKET_KEYS if key in stn_data}
+    market['commodities'] = [{key: com[key] for key in COMMODITY_KEYS if key in com} for com in stn_data['commodities']]
+    compact['data'] = market
+    return compact
@@ -0,0 +1,15 @@
+"""
+Import the stockbot package from this checkout, with a throwaway ENV_DIR so tests never touch a real .env or carriers.db.
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ.update({
+    'ENV_DIR': tempfile.mkdtemp(prefix='stockbot-tests-'),
+    'FLEET_CARRIERS': '{}',
+    'METRICS_PORT': '0',
+    'LOG_FILE': '',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+"""
+CapiClient batching against the local cAPI proxy stand-in, tools/capi_stub.py.
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stockbot import capi, upstream
+from stockbot.capi import CapiClient
+from stockbot.upstream import CircuitBreaker
+from tools.capi_stub import carrier_market, make_app
+
+CARRIERS = ['AAA-111', 'BBB-222', 'CCC-333']
+
+
+@pytest.fixture(autouse=True)
+def breaker(monkeypatch):
+    # a fresh circuit per test, so failures don't carry over.
+    monkeypatch.setattr(capi, 'capi_breaker', CircuitBreaker('cAPI'))
+
+
+def fetch(app, carrierids, batch_size=2, prefetch=False):
+    # (client, responses) of fetching carriers from app, served on a local port.
+    async def main():
+        server = TestServer(app)
+        await server.start_server()
+        client = CapiClient(f"http://{server.host}:{server.port}", 'token', batch_size)
+        try:
+            if prefetch:
+                client.prefetch(carrierids)
+                responses = dict(zip(carrierids, await asyncio.gather(*[client.carrier(carrierid) for carrierid in carrierids])))
+            else:
+                responses = await client.carriers(carrierids)
+        finally:
+            await server.close()
+            await upstream.http_session.close()
+        return client, responses
+    return asyncio.run(main())
+
+
+def test_batch():
+    app = make_app()
+    client, responses = fetch(app, CARRIERS)
+    assert client.batch_supported is True
+    assert responses == {carrierid: (200, carrier_market(carrierid)) for carrierid in CARRIERS}
+    assert app['stats'] == {'single': 0, 'batch': 2, 'batch_carriers': 3}
+
+
+def test_prefetch():
+    app = make_app()
+    client, responses = fetch(app, CARRIERS, batch_size=10, prefetch=True)
+    assert responses == {carrierid: (200, carrier_market(carrierid)) for carrierid in CARRIERS}
+    assert app['stats'] == {'single': 0, 'batch': 1, 'batch_carriers': 3}
+    assert not client.tasks
+
+
+async def not_found(request):
+    return web.json_response({'error': 'not found'}, status=404)
+
+
+@pytest.mark.parametrize('status', [404, 405])
+def test_no_batch_endpoint(status):
+    # without the batch route, the stub answers POST /capi/batch with 405.
+    app = make_app(batch=False)
+    if status == 404:
+        app.router.add_post('/capi/batch', not_found)
+    client, responses = fetch(app, CARRIERS)
+    assert client.batch_supported is False
+    assert responses == {carrierid: (200, carrier_market(carrierid)) for carrierid in CARRIERS}
+    assert app['stats']['single'] == 3
+
+
+@pytest.mark.parametrize('status', [418, 500, 503])
+def test_batch_unavailable(status):
+    # maintenance or a broken proxy applies to every carrier of the batch, without a request per carrier.
+    app = make_app(batch_status=status)
+    client, responses = fetch(app, CARRIERS)
+    assert client.batch_supported is True
+    assert set(responses) == set(CARRIERS)
+    assert all(response[0] == status for response in responses.values())
+    assert app['stats']['single'] == 0
+    assert capi.capi_breaker.failures == 2
+
+
+def test_batch_missing_carriers():
+    app = make_app(missing={'BBB-222'})
+    client, responses = fetch(app, CARRIERS)
+    assert responses == {carrierid: (200, carrier_market(carrierid)) for carrierid in CARRIERS}
+    assert app['stats'] == {'single': 1, 'batch': 2, 'batch_carriers': 3}
@@ -0,0 +1,117 @@
+"""
+OwnerNotifier: digests, retries and alerts for carriers that changed hands.
+"""
+
+import asyncio
+
+import pytest
+
+from stockbot import channels
+from stockbot.channels import OwnerNotifier
+from stockbot.store import FCDATA, CarrierIndex
+
+OWNER, OTHER = 111111111111111111, 222222222222222222
+
+
+@pytest.fixture
+def carriers(monkeypatch):
+    # AAA-111 and BBB-222 owned by OWNER (as a mention and an id), CCC-333 by OTHER.
+    for fcid, owner in (('AAA-111', f'<@{OWNER}>'), ('BBB-222', str(OWNER)), ('CCC-333', str(OTHER))):
+        monkeypatch.setitem(FCDATA, fcid, {'FCName': fcid.lower(), 'owner': owner, 'wmm': 'Malerba'})
+    index = CarrierIndex()
+    index.rebuild({fcid: FCDATA[fcid] for fcid in ('AAA-111', 'BBB-222', 'CCC-333')})
+    monkeypatch.setattr(channels, 'carrier_index', index)
+    saved = []
+    monkeypatch.setattr(channels, 'save_carriers', saved.extend)
+    return index, saved
+
+
+class Sent(list):
+    # (owner, message) of every DM sent, owners in failing don't get theirs.
+    failing = ()
+
+
+@pytest.fixture
+def dms(monkeypatch):
+    sent = Sent()
+    sent.failing = set()
+
+    async def dm_bot_owner(fcid, owner, message):
+        if owner in sent.failing:
+            return False
+        sent.append((owner, message))
+        return True
+    monkeypatch.setattr(channels, 'dm_bot_owner', dm_bot_owner)
+    return sent
+
+
+def alerts(count, length):
+    return {(f'C{index:02}-000', 'low'): {'fcid': f'C{index:02}-000', 'message': 'x' * length} for index in range(count)}
+
+
+def test_digest_empty():
+    assert OwnerNotifier.digests({}) == []
+
+
+def test_digest_single():
+    assert OwnerNotifier.digests(alerts(1, 3000)) == [('x' * 3000, [('C00-000', 'low')])]
+
+
+def test_digest_split():
+    queued = alerts(20, 150)
+    digests = OwnerNotifier.digests(queued)
+    assert len(digests) == 2
+    assert all(len(message) <= 2000 for message, keys in digests)
+    assert digests[0][0].startswith("Updates on your Fleet Carriers:\n- x")
+    assert digests[1][0].startswith("Updates on your Fleet Carriers (continued):\n- x")
+    assert [key for message, keys in digests for key in keys] == list(queued)
+    assert [message.count('\n') for message, keys in digests] == [len(keys) for message, keys in digests]
+
+
+def test_one_digest_per_owner(carriers, dms):
+    notifier = OwnerNotifier(0, 3)
+    notifier.queue('AAA-111', 'low', 'AAA-111 is low', notified='indite')
+    notifier.queue('BBB-222', 'low', 'BBB-222 is low')
+    # queued once until delivered.
+    notifier.queue('BBB-222', 'low', 'BBB-222 is still low')
+    notifier.queue('CCC-333', 'reauth', 'CCC-333 needs to re-auth')
+    asyncio.run(notifier.flush())
+    assert dms == [(OWNER, "Updates on your Fleet Carriers:\n- AAA-111 is low\n- BBB-222 is low"), (OTHER, 'CCC-333 needs to re-auth')]
+    assert not notifier.pending
+    assert FCDATA['AAA-111']['notified'] == {'indite': True}
+    assert carriers[1] == ['AAA-111']
+
+
+def test_retry_then_drop(carriers, dms):
+    notifier = OwnerNotifier(0, 2)
+    notifier.queue('AAA-111', 'low', 'AAA-111 is low')
+    notifier.queue('CCC-333', 'low', 'CCC-333 is low')
+    dms.failing.add(OWNER)
+    asyncio.run(notifier.flush())
+    assert notifier.pending[OWNER][('AAA-111', 'low')]['attempts'] == 1
+    assert OTHER not in notifier.pending
+    # a new alert starts with its own attempts.
+    notifier.queue('BBB-222', 'low', 'BBB-222 is low')
+    asyncio.run(notifier.flush())
+    assert list(notifier.pending[OWNER]) == [('BBB-222', 'low')]
+    dms.failing.clear()
+    asyncio.run(notifier.flush())
+    assert dms == [(OTHER, 'CCC-333 is low'), (OWNER, 'BBB-222 is low')]
+    assert not notifier.pending
+
+
+def test_carrier_changed_hands(carriers, dms, monkeypatch):
+    index, saved = carriers
+    notifier = OwnerNotifier(0, 3)
+    notifier.queue('AAA-111', 'low', 'AAA-111 is low', notified='indite')
+    notifier.queue('BBB-222', 'low', 'BBB-222 is low')
+    notifier.queue('CCC-333', 'low', 'CCC-333 is low')
+    # AAA-111 deleted, CCC-333 given to OWNER.
+    monkeypatch.delitem(FCDATA, 'AAA-111')
+    index.remove('AAA-111')
+    FCDATA['CCC-333']['owner'] = str(OWNER)
+    index.update('CCC-333', FCDATA['CCC-333'])
+    asyncio.run(notifier.flush())
+    assert dms == [(OWNER, 'BBB-222 is low')]
+    assert not notifier.pending
+    assert not saved
@@ -0,0 +1,106 @@
+"""
+The regex inara parser against the BeautifulSoup one, over saved inara market pages, and inara error statuses.
+"""
+
+import asyncio
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from stockbot import inara as inara_module, upstream
+from stockbot.inara import inara_market_time, parse_inara_market_fast, parse_inara_market_soup
+from stockbot.sources import inara_fc_market_data, upstream_unavailable
+from stockbot.upstream import CircuitBreaker, RateLimiter
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'inara')
+PAGES = sorted(name for name in os.listdir(FIXTURES) if name.endswith('.html'))
+
+
+def page(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', PAGES)
+def test_parsers_agree(name):
+    content = page(name)
+    assert parse_inara_market_fast('FIXTURE', content) == parse_inara_market_soup('FIXTURE', content)
+
+
+def test_market():
+    market = parse_inara_market_fast('K7Q-BQL', page('market.html'))
+    assert market['full_name'] == 'P.T.N. Sunset Boulevard (K7Q-BQL)'
+    assert market['name'] == market['currentStarSystem'] == 'Leesti'
+    assert market['sName'] == 'K7Q-BQL'
+    assert inara_market_time(market) is not None
+    # subheader rows are skipped.
+    assert [com['name'] for com in market['commodities']] == ['Gold', 'Silver', 'Bertrandite', 'Indite', 'Fish & Chips', 'Tea\xa0–\xa0Earl Grey']
+    indite = market['commodities'][3]
+    assert (indite['sellPrice'], indite['demand'], indite['buyPrice'], indite['stock']) == (11500, 0, 11000, 1234567)
+    # "-" cells are zero.
+    silver = market['commodities'][1]
+    assert (silver['sellPrice'], silver['demand'], silver['buyPrice'], silver['stock']) == (0, 1200, 0, 0)
+
+
+def test_entities():
+    market = parse_inara_market_fast('X9X-9Y9', page('entities.html'))
+    assert market['full_name'] == "Ben's Bar & Grill (X9X-9Y9)"
+    assert market['name'] == 'Col 285 Sector "AB" c12-3'
+    assert market['market_updated'] == 'just now (18 Oct 2026, 9:05am)'
+    assert [com['name'] for com in market['commodities']] == ['Cöbalt <raw>', 'Low Temperature Diamonds']
+
+
+def test_empty_market():
+    market = parse_inara_market_fast('Q2K-44W', page('empty.html'))
+    assert market['full_name'] == 'Empty Hold (Q2K-44W)'
+    assert market['commodities'] == []
+
+
+@pytest.fixture
+def inara(monkeypatch):
+    # serve status from a local stand-in for inara, with a fresh circuit and no rate limit.
+    breaker = CircuitBreaker('Inara')
+    monkeypatch.setattr(inara_module, 'inara_breaker', breaker)
+    monkeypatch.setattr(inara_module, 'inara_limiter', RateLimiter(0))
+
+    def serve(status):
+        async def market(request):
+            return web.Response(status=status, body=page('market.html'), content_type='text/html')
+
+        async def main():
+            app = web.Application()
+            app.router.add_get('/elite/station-market/', market)
+            server = TestServer(app)
+            await server.start_server()
+            monkeypatch.setattr(inara_module, 'INARA_URL', f"http://{server.host}:{server.port}")
+            try:
+                return await inara_fc_market_data('K7Q-BQL')
+            finally:
+                await server.close()
+                await upstream.http_session.close()
+        return asyncio.run(main())
+    serve.breaker = breaker
+    return serve
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_inara_carrier_error(inara, status):
+    # a failure for this carrier only, inara itself is fine.
+    assert inara(status) is False
+    assert inara.breaker.failures == 0
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_inara_unavailable(inara, status):
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        inara(status)
+    assert upstream_unavailable(error.value)
+    assert inara.breaker.failures == 1
+
+
+def test_inara_ok(inara):
+    assert inara(200)['full_name'] == 'P.T.N. Sunset Boulevard (K7Q-BQL)'
+    assert inara.breaker.failures == 0
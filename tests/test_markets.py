@@ -0,0 +1,184 @@
+"""
+MarketCache: single-flight fetches, TTL, LRU eviction, invalidation and stale markets.
+MarketFingerprints: recognising unchanged responses before and after parsing.
+"""
+
+import asyncio
+
+from stockbot.markets import MarketCache, MarketFingerprints
+
+
+def market(name):
+    return {'name': name, 'commodities': []}
+
+
+def age(cache, key, seconds):
+    # pretend the entry was fetched seconds earlier.
+    fetched, timestamp, stn_data = cache.entries[key]
+    cache.entries[key] = (fetched - seconds, timestamp - seconds, stn_data)
+
+
+class Fetch:
+    # counts calls, and answers with result once released.
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.result
+
+
+def test_single_flight():
+    async def main():
+        cache = MarketCache({'inara': 60}, 10)
+        fetch = Fetch(market('a'))
+        lookups = [asyncio.create_task(cache.get('AAA-111', 'inara', fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        results = await asyncio.gather(*lookups)
+        assert fetch.calls == 1
+        assert all(result is fetch.result for result in results)
+        assert cache.stats() == {'entries': 1, 'hits': 0, 'misses': 1, 'shared': 4, 'hit_rate': 0.8}
+        # answered from the cache now.
+        assert await cache.get('AAA-111', 'inara', fetch) is fetch.result
+        assert fetch.calls == 1
+    asyncio.run(main())
+
+
+def test_failed_fetch_not_cached():
+    async def main():
+        cache = MarketCache({'inara': 60}, 10)
+        fetch = Fetch(False)
+        fetch.release.set()
+        assert await cache.get('AAA-111', 'inara', fetch) is False
+        assert await cache.get('AAA-111', 'inara', fetch) is False
+        assert fetch.calls == 2
+        assert not cache.entries
+    asyncio.run(main())
+
+
+def test_ttl():
+    async def main():
+        cache = MarketCache({'inara': 60, 'capi': 300}, 10)
+        first = Fetch(market('a'))
+        first.release.set()
+        await cache.get('AAA-111', 'inara', first)
+        await cache.get('AAA-111', 'capi', first)
+        age(cache, ('AAA-111', 'inara'), 61)
+        age(cache, ('AAA-111', 'capi'), 61)
+        assert not cache.fresh('AAA-111', 'inara')
+        assert cache.fresh('AAA-111', 'capi')
+        second = Fetch(market('b'))
+        second.release.set()
+        assert await cache.get('AAA-111', 'inara', second) is second.result
+        assert await cache.get('AAA-111', 'capi', second) is first.result
+        assert second.calls == 1
+    asyncio.run(main())
+
+
+def test_lru_eviction():
+    cache = MarketCache({'inara': 60}, 2)
+    cache.put('AAA-111', 'inara', market('a'))
+    cache.put('BBB-222', 'inara', market('b'))
+    # a hit makes AAA-111 the most recently used.
+    assert asyncio.run(cache.get('AAA-111', 'inara', Fetch(None))) == market('a')
+    cache.put('CCC-333', 'inara', market('c'))
+    assert list(cache.entries) == [('AAA-111', 'inara'), ('CCC-333', 'inara')]
+    assert cache.last_good('BBB-222', 'inara') is None
+
+
+def test_invalidate_while_fetching():
+    async def main():
+        cache = MarketCache({'inara': 60, 'capi': 300}, 10)
+        fetch = Fetch(market('old'))
+        lookup = asyncio.create_task(cache.get('AAA-111', 'inara', fetch))
+        await asyncio.sleep(0)
+        cache.invalidate('AAA-111')
+        fetch.release.set()
+        # the caller still gets its answer, but it isn't cached.
+        assert await lookup is fetch.result
+        assert ('AAA-111', 'inara') not in cache.entries
+        assert not cache.inflight
+        assert not cache.fresh('AAA-111', 'inara')
+    asyncio.run(main())
+
+
+def test_stale():
+    cache = MarketCache({'inara': 60}, 10)
+    assert cache.stale('AAA-111', 'inara') is None
+    cache.put('AAA-111', 'inara', market('a'))
+    stale = cache.stale('AAA-111', 'inara')
+    assert stale['stale'] == cache.last_good('AAA-111', 'inara')[0]
+    assert 'stale' not in cache.last_good('AAA-111', 'inara')[1]
+    # the same object until a new market is cached.
+    assert cache.stale('AAA-111', 'inara') is stale
+    cache.put('AAA-111', 'inara', market('b'))
+    assert cache.stale('AAA-111', 'inara') is not stale
+    assert cache.stale('AAA-111', 'inara')['name'] == 'b'
+    cache.invalidate('AAA-111')
+    assert cache.stale('AAA-111', 'inara') is None
+    assert not cache.stale_markets
+
+
+def fingerprinted(fingerprints, previous, status, headers, content):
+    # the market for a response, as inara_fc_market_data gets it: the previous one if unchanged, else parsed.
+    fingerprint = fingerprints.fingerprint(status, headers, content)
+    if previous and fingerprints.matches('AAA-111', 'inara', fingerprint):
+        return previous[1]
+    return fingerprints.parsed('AAA-111', 'inara', fingerprint, {'content': content.decode()}, previous)
+
+
+def test_fingerprint_headers():
+    fingerprints = MarketFingerprints()
+    assert fingerprints.headers('AAA-111', 'inara') == {}
+    fingerprinted(fingerprints, None, 200, {'ETag': '"a"', 'Last-Modified': 'Sun, 18 Oct 2026 09:00:00 GMT'}, b'a')
+    assert fingerprints.headers('AAA-111', 'inara') == {'If-None-Match': '"a"', 'If-Modified-Since': 'Sun, 18 Oct 2026 09:00:00 GMT'}
+    assert fingerprints.headers('AAA-111', 'capi') == {}
+
+
+def test_not_modified():
+    fingerprints = MarketFingerprints()
+    previous = (0, fingerprinted(fingerprints, None, 200, {'ETag': '"a"'}, b'a'))
+    assert fingerprinted(fingerprints, previous, 304, {}, b'') is previous[1]
+    # the validators of the parsed response are kept.
+    assert fingerprints.headers('AAA-111', 'inara') == {'If-None-Match': '"a"'}
+
+
+def test_same_etag():
+    fingerprints = MarketFingerprints()
+    previous = (0, fingerprinted(fingerprints, None, 200, {'ETag': '"a"'}, b'a'))
+    # the etag says nothing changed, whatever the body.
+    assert fingerprinted(fingerprints, previous, 200, {'ETag': '"a"', 'Last-Modified': 'later'}, b'a, reformatted') is previous[1]
+    assert fingerprints.headers('AAA-111', 'inara') == {'If-None-Match': '"a"', 'If-Modified-Since': 'later'}
+
+
+def test_same_hash():
+    fingerprints = MarketFingerprints()
+    previous = (0, fingerprinted(fingerprints, None, 200, {}, b'a'))
+    assert fingerprinted(fingerprints, previous, 200, {'ETag': '"b"'}, b'a') is previous[1]
+    assert fingerprints.headers('AAA-111', 'inara') == {'If-None-Match': '"b"'}
+
+
+def test_same_data():
+    fingerprints = MarketFingerprints()
+    previous = (0, fingerprinted(fingerprints, None, 200, {}, b'a'))
+    # a different response that parses to the same market, e.g. a new page layout.
+    fingerprint = fingerprints.fingerprint(200, {}, b'a, reformatted')
+    assert not fingerprints.matches('AAA-111', 'inara', fingerprint)
+    assert fingerprints.parsed('AAA-111', 'inara', fingerprint, {'content': 'a'}, previous) is previous[1]
+    # and the new response is what is matched next time.
+    assert fingerprints.matches('AAA-111', 'inara', fingerprints.fingerprint(200, {}, b'a, reformatted'))
+
+
+def test_changed():
+    fingerprints = MarketFingerprints()
+    previous = (0, fingerprinted(fingerprints, None, 200, {'ETag': '"a"'}, b'a'))
+    changed = fingerprinted(fingerprints, previous, 200, {'ETag': '"b"'}, b'b')
+    assert changed is not previous[1]
+    assert changed == {'content': 'b'}
+    # failed parses are passed on and not remembered.
+    assert fingerprints.parsed('AAA-111', 'inara', fingerprints.fingerprint(200, {}, b'c'), False, (0, changed)) is False
+    assert fingerprints.headers('AAA-111', 'inara') == {'If-None-Match': '"b"'}
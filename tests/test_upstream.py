@@ -0,0 +1,58 @@
+"""
+CircuitBreaker state transitions.
+"""
+
+import asyncio
+
+import aiohttp
+import pytest
+
+from stockbot.upstream import CircuitBreaker, CircuitOpenError
+
+
+async def ok():
+    return 200, 'ok'
+
+
+async def down():
+    raise aiohttp.ClientConnectionError('connection refused')
+
+
+def test_breaker_transitions():
+    async def main():
+        breaker = CircuitBreaker('test', threshold=2, backoff=0.05, max_backoff=1)
+        # failures below the threshold, or a response the caller doesn't count as failed, keep it closed.
+        with pytest.raises(aiohttp.ClientError):
+            await breaker.call(down)
+        assert await breaker.call(ok, failed=lambda response: response[0] >= 500) == (200, 'ok')
+        assert (breaker.state, breaker.failures) == ('closed', 0)
+
+        for _ in range(2):
+            with pytest.raises(aiohttp.ClientError):
+                await breaker.call(down)
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)
+
+        # after the backoff one probe is let through, a failed probe re-opens with double the backoff.
+        await asyncio.sleep(0.06)
+        with pytest.raises(aiohttp.ClientError):
+            await breaker.call(down)
+        assert (breaker.state, breaker.backoff) == ('open', 0.1)
+
+        await asyncio.sleep(0.11)
+        answer = asyncio.Event()
+
+        async def slow():
+            await answer.wait()
+            return await ok()
+        probe = asyncio.create_task(breaker.call(slow))
+        await asyncio.sleep(0)
+        assert breaker.state == 'half-open'
+        # only the probe goes through while half-open.
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)
+        answer.set()
+        assert await probe == (200, 'ok')
+        assert (breaker.state, breaker.failures, breaker.backoff) == ('closed', 0, 0.05)
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+aggregate_wmm: per-carrier WMM commodities and per-station totals.
+"""
+
+import pytest
+
+from stockbot.markets import market_snapshots
+from stockbot.store import FCDATA
+from stockbot.wmm import WmmCommodity, aggregate_wmm
+
+INDITE, GOLD, BERTRANDITE, SILVER = (market_snapshots.intern(commodity) for commodity in ('indite', 'gold', 'bertrandite', 'silver'))
+
+
+def result(fcid, system, commodities, source='inara'):
+    return {'fcid': fcid, 'source': source, 'status': None, 'reauth': False, 'data': {
+        'currentStarSystem': system, 'full_name': f"Carrier {fcid}", 'market_updated': 'just now (18 Oct 2026, 9:05am)',
+        'commodities': [{'name': name, 'stock': stock, 'demand': 0, 'buyPrice': price, 'sellPrice': 0} for name, stock, price in commodities]}}
+
+
+@pytest.fixture
+def carriers(monkeypatch):
+    for fcid, station in (('AAA-111', 'Malerba'), ('BBB-222', 'Malerba'), ('CCC-333', 'Gandalf'), ('DDD-444', 'Gandalf'), ('EEE-555', 'Gandalf')):
+        monkeypatch.setitem(FCDATA, fcid, {'FCName': fcid.lower(), 'wmm': station})
+    # tracked, but not for wmm.
+    monkeypatch.setitem(FCDATA, 'FFF-666', {'FCName': 'fff-666'})
+
+
+def test_aggregate_wmm(carriers):
+    results = [
+        result('AAA-111', 'Leesti', [('Indite', 5000, 11000), ('Gold', 200, 48000), ('Tritium', 900, 50000), ('Silver', 0, 4000)]),
+        result('BBB-222', 'Leesti', [('indite', 1000, 10500), ('Bertrandite', 300, 17500)], source='capi'),
+        # empty market.
+        result('CCC-333', 'Col 285', []),
+        # no WMM commodities.
+        result('DDD-444', 'Col 285', [('Tritium', 20000, 50000)]),
+        # fetch failed.
+        {'fcid': 'EEE-555', 'source': None, 'status': None, 'reauth': False, 'data': None},
+        result('FFF-666', 'Leesti', [('Indite', 7000, 11000)]),
+        # removed while fetching.
+        result('GGG-777', 'Leesti', [('Indite', 9000, 11000)]),
+    ]
+    forecasts = {('AAA-111', INDITE): 2.0, ('BBB-222', INDITE): 48.0}
+
+    carriers, totals = aggregate_wmm(results, forecasts)
+
+    assert totals == {
+        'Leesti': {'Malerba': {INDITE: 6000, GOLD: 200, BERTRANDITE: 300}},
+        'Col 285': {'Gandalf': {}},
+    }
+    assert list(carriers) == ['Malerba', 'Gandalf']
+    aaa, bbb = carriers['Malerba']
+    assert (aaa.fcid, aaa.system, aaa.station, aaa.has_market) == ('AAA-111', 'Leesti', 'Malerba', True)
+    # forecast to run out within WMM_EMPTY_ALERT_HOURS, and below 1000 without a forecast.
+    assert aaa.commodities == [WmmCommodity('Indite', 5000, 11000, 2.0, True), WmmCommodity('Gold', 200, 48000, None, True)]
+    assert bbb.commodities == [WmmCommodity('indite', 1000, 10500, 48.0, False), WmmCommodity('Bertrandite', 300, 17500, None, True)]
+    assert bbb.market_updated == ''
+    ccc, ddd = carriers['Gandalf']
+    assert (ccc.fcid, ccc.has_market, ccc.commodities) == ('CCC-333', False, [])
+    assert (ddd.fcid, ddd.has_market, ddd.commodities) == ('DDD-444', True, [])
+
+
+def test_aggregate_wmm_nothing_fetched(carriers):
+    assert aggregate_wmm([], {}) == ({}, {})
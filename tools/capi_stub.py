@@ -0,0 +1,106 @@
+"""
+Local stand-in for the PTN cAPI proxy, for trying out and benchmarking the bot without Frontier.
+
+Serves synthetic carrier markets on the same endpoints the bot uses:
+    GET  /capi/<carrier id>       a single carrier
+    POST /capi/batch              {"carriers": [ids]} -> {"carriers": {id: {"status": 200, "data": {...}}}}
+    GET  /generate/<carrier id>   a fake oauth token
+
+Point the bot at it with API_HOST=http://127.0.0.1:8081 (any API_TOKEN works).
+
+Usage: python tools/capi_stub.py [--port 8081] [--latency 0.2] [--no-batch] [--status 418] [--batch-status 503]
+"""
+import argparse
+import asyncio
+import random
+from aiohttp import web
+
+COMMODITIES = ['Indite', 'Bertrandite', 'Gold', 'Silver', 'Tritium', 'Water', 'Liquid oxygen', 'Steel',
+               'Titanium', 'Aluminium', 'Copper', 'Polymers', 'Semiconductors', 'Superconductors', 'Food cartridges']
+
+
+def carrier_market(carrierid):
+    # the same carrier always gets the same name, system and market.
+    rng = random.Random(carrierid)
+    vanity_name = f"Stub Carrier {carrierid}".encode().hex().upper()
+    return {
+        'name': {'vanityName': vanity_name, 'callsign': carrierid},
+        'currentStarSystem': rng.choice(['Sol', 'Leesti', 'Lave', 'Diso', 'Shinrarta Dezhra']),
+        'market': {
+            'commodities': [
+                {'name': name, 'stock': rng.choice([0, rng.randint(1, 25000)]), 'demand': rng.randint(0, 5000),
+                 'buyPrice': rng.randint(1000, 60000), 'sellPrice': rng.randint(1000, 60000)}
+                for name in COMMODITIES
+            ],
+        },
+    }
+
+
+def make_app(latency=0.0, batch=True, status=200, batch_status=200, missing=()):
+    # status answers every carrier, batch_status the batch request itself, carriers in missing are left out of batch answers.
+    stats = {'single': 0, 'batch': 0, 'batch_carriers': 0}
+
+    def response(carrierid):
+        if status != 200:
+            return status, {'error': f"stub status {status}"}
+        return 200, carrier_market(carrierid)
+
+    async def capi(request):
+        stats['single'] += 1
+        await asyncio.sleep(latency)
+        code, data = response(request.match_info['carrierid'])
+        return web.json_response(data, status=code)
+
+    async def capi_batch(request):
+        body = await request.json()
+        stats['batch'] += 1
+        stats['batch_carriers'] += len(body['carriers'])
+        await asyncio.sleep(latency)
+        if batch_status != 200:
+            return web.json_response({'error': f"stub batch status {batch_status}"}, status=batch_status)
+        carriers = {}
+        for carrierid in body['carriers']:
+            if carrierid in missing:
+                continue
+            code, data = response(carrierid)
+            carriers[carrierid] = {'status': code, 'data': data}
+        return web.json_response({'carriers': carriers})
+
+    async def generate(request):
+        await asyncio.sleep(latency)
+        return web.json_response({'token': f"stub-{request.match_info['carrierid']}"})
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_get('/capi/{carrierid}', capi)
+    if batch:
+        app.router.add_post('/capi/batch', capi_batch)
+    app.router.add_get('/generate/{carrierid}', generate)
+    app.router.add_get('/stats', get_stats)
+    # gzip the responses when the client asks for it, like the real proxy.
+    app.on_response_prepare.append(compress)
+    return app
+
+
+async def compress(request, response):
+    if isinstance(response, web.Response) and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.enable_compression()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--no-batch', action='store_true', help='serve without the /capi/batch endpoint')
+    parser.add_argument('--status', type=int, default=200, help='status to answer every carrier with, e.g. 418')
+    parser.add_argument('--batch-status', type=int, default=200, help='status to answer batch requests with, e.g. 503')
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, not args.no_batch, args.status, args.batch_status), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,626 @@
+"""
+Offline replay and load test harness for the WMM pipeline.
+
+Records real cAPI JSON and Inara market pages into a fixture corpus, replays them from local stand-in
+servers with configurable latency, errors and stock churn, and drives the bot's own fetch, aggregate and
+render code against fake discord channels. Reports cycle latency, throughput and upstream call counts.
+
+    python tools/replay.py record --env-dir /path/to/bot --out corpus     record the bot's carriers
+    python tools/replay.py serve --corpus corpus --latency 0.05            stand-ins only, for running the bot
+    python tools/replay.py bench --corpus corpus --fleet 10,100,1000       wmm cycles and ;stock over fleets
+    python tools/replay.py micro --corpus corpus                           parser, table, forecast, aggregation and history
+
+The corpus is a directory of capi/<carrier id>.json ({"status": ..., "data": ...}) and inara/<carrier id>.html.
+Carriers that were not recorded are served a recorded response relabelled with their id, or the synthetic
+markets of capi_stub.py if nothing was recorded for that upstream, so any fleet size can be replayed.
+record needs API_HOST and API_TOKEN for the cAPI proxy, and fetches at most one Inara page a second.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+import aiohttp
+from aiohttp import web
+
+from capi_stub import carrier_market, compress
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INARA_UPDATED_RE = re.compile(rb'(<div[^>]*>Market update</div>\s*<div[^>]*>)(.*?)(</div>)', re.S)
+
+
+def inara_page(carrierid, market):
+    # an Inara station-market page for a cAPI style market, laid out like the real thing as far as the parsers care.
+    rows = []
+    for com in market['market']['commodities']:
+        rows.append(f'<tr><td class="lineright"><a href="/elite/commodity/1/"><span class="avoidwrap">{com["name"]}</span></a></td>'
+                    f'<td class="lineright alignright">{com["sellPrice"]:,} Cr</td>'
+                    f'<td class="alignright">{format(com["demand"], ",") if com["demand"] else "-"}</td>'
+                    f'<td class="lineright alignright">{com["buyPrice"]:,} Cr</td>'
+                    f'<td class="alignright">{format(com["stock"], ",") if com["stock"] else "-"}</td></tr>')
+    updated = time.strftime("%d %b %Y, %I:%M%p", time.gmtime())
+    return f'''<!DOCTYPE html><html><head><title>{carrierid}</title></head><body><div class="maincontainer">
+<div class="mainblock"><div class="headercontent"><h2><a href="/elite/station/{zlib.crc32(carrierid.encode())}/">Replay Carrier ({carrierid})</a> | <a href="/elite/starsystem/1/">{market["currentStarSystem"]}</a></h2></div>
+<div class="itempaircontainer"><div class="itempairlabel">Market update</div><div class="itempairvalue">just now ({updated})</div></div></div>
+<div class="mainblock maintable"><table class="tablesorterintab"><thead><tr><th>Commodity</th><th>Sell</th><th>Demand</th><th>Buy</th><th>Supply</th></tr></thead>
+<tbody>{"".join(rows)}</tbody></table></div></div></body></html>'''.encode()
+
+
+class Corpus:
+    """
+    Recorded upstream responses. capi() and inara() answer for any carrier id: the carrier's own recording,
+    else a recording picked by carrier id and relabelled, else a synthetic market.
+    """
+    def __init__(self, path=None):
+        self.capi_responses = {}
+        self.inara_pages = {}
+        if not path:
+            return
+        for name in self.listdir(path, 'capi', '.json'):
+            with open(os.path.join(path, 'capi', name)) as f:
+                response = json.load(f)
+            self.capi_responses[name[:-5]] = (response['status'], response['data'])
+        for name in self.listdir(path, 'inara', '.html'):
+            with open(os.path.join(path, 'inara', name), 'rb') as f:
+                self.inara_pages[name[:-5]] = f.read()
+
+    @staticmethod
+    def listdir(path, upstream, extension):
+        directory = os.path.join(path, upstream)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if name.endswith(extension))
+
+    @staticmethod
+    def pick(recorded, carrierid):
+        ids = sorted(recorded)
+        return ids[zlib.crc32(carrierid.encode()) % len(ids)]
+
+    def capi(self, carrierid):
+        if carrierid in self.capi_responses:
+            status, data = self.capi_responses[carrierid]
+            return status, json.loads(json.dumps(data))
+        if self.capi_responses:
+            recorded = self.pick(self.capi_responses, carrierid)
+            status, data = self.capi_responses[recorded]
+            return status, json.loads(json.dumps(data).replace(recorded, carrierid))
+        return 200, carrier_market(carrierid)
+
+    def inara(self, carrierid):
+        if carrierid in self.inara_pages:
+            return self.inara_pages[carrierid]
+        if self.inara_pages:
+            recorded = self.pick(self.inara_pages, carrierid)
+            return self.inara_pages[recorded].replace(recorded.encode(), carrierid.encode())
+        return inara_page(carrierid, carrier_market(carrierid))
+
+    def __len__(self):
+        return len(self.capi_responses) + len(self.inara_pages)
+
+
+class StandIns:
+    """
+    Local cAPI proxy and Inara servers replaying a Corpus.
+    Every response waits `latency` seconds (plus up to `jitter`), fails with `capi_error` or `inara_error`
+    with probability `error_rate`, and with probability `churn` comes with a changed market, as if the
+    carrier had sold some stock since the last request. Calls and injected errors are counted in `calls`.
+    """
+    def __init__(self, corpus, latency=0.0, jitter=0.0, error_rate=0.0, churn=0.0,
+                 capi_error=418, inara_error=503, batch=True, seed=1):
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.churn = churn
+        self.capi_error = capi_error
+        self.inara_error = inara_error
+        self.batch = batch
+        self.rng = random.Random(seed)
+        self.capi_markets = {}
+        self.inara_markets = {}
+        self.runners = []
+        self.urls = {}
+        self.reset()
+
+    def reset(self):
+        self.calls = {'capi': 0, 'capi_batch': 0, 'capi_batch_carriers': 0, 'inara': 0, 'capi_errors': 0, 'inara_errors': 0}
+
+    async def delay(self):
+        await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def failing(self):
+        return self.rng.random() < self.error_rate
+
+    def capi_market(self, carrierid):
+        if self.failing():
+            self.calls['capi_errors'] += 1
+            return self.capi_error, {'error': f"replay status {self.capi_error}"}
+        if carrierid not in self.capi_markets:
+            self.capi_markets[carrierid] = self.corpus.capi(carrierid)
+        status, data = self.capi_markets[carrierid]
+        if status == 200 and self.rng.random() < self.churn:
+            for com in data.get('market', {}).get('commodities', []):
+                if com['stock']:
+                    com['stock'] = max(0, com['stock'] - self.rng.randint(1, max(1, com['stock'] // 20)))
+        return status, data
+
+    def inara_market(self, carrierid):
+        if carrierid not in self.inara_markets:
+            self.inara_markets[carrierid] = self.corpus.inara(carrierid)
+        if self.rng.random() < self.churn:
+            # a new "Market update" time is enough for the bot to see a changed market.
+            updated = time.strftime("just now (%d %b %Y, %I:%M%p)", time.gmtime()).encode() + b' #%d' % self.rng.randrange(1 << 30)
+            self.inara_markets[carrierid] = INARA_UPDATED_RE.sub(lambda m: m.group(1) + updated + m.group(3), self.inara_markets[carrierid], count=1)
+        return self.inara_markets[carrierid]
+
+    async def capi(self, request):
+        self.calls['capi'] += 1
+        await self.delay()
+        status, data = self.capi_market(request.match_info['carrierid'])
+        return web.json_response(data, status=status)
+
+    async def capi_batch(self, request):
+        body = await request.json()
+        self.calls['capi_batch'] += 1
+        self.calls['capi_batch_carriers'] += len(body['carriers'])
+        await self.delay()
+        carriers = {}
+        for carrierid in body['carriers']:
+            status, data = self.capi_market(carrierid)
+            carriers[carrierid] = {'status': status, 'data': data}
+        return web.json_response({'carriers': carriers})
+
+    async def inara(self, request):
+        self.calls['inara'] += 1
+        await self.delay()
+        if self.failing():
+            self.calls['inara_errors'] += 1
+            return web.Response(status=self.inara_error, text='replay error')
+        return web.Response(body=self.inara_market(request.query.get('search', '')), content_type='text/html')
+
+    def capi_app(self):
+        app = web.Application()
+        app.router.add_get('/capi/{carrierid}', self.capi)
+        if self.batch:
+            app.router.add_post('/capi/batch', self.capi_batch)
+        app.on_response_prepare.append(compress)
+        return app
+
+    def inara_app(self):
+        app = web.Application()
+        app.router.add_get('/elite/station-market/', self.inara)
+        app.on_response_prepare.append(compress)
+        return app
+
+    async def start(self, host='127.0.0.1', capi_port=0, inara_port=0):
+        # port 0 picks a free port, the base urls end up in self.urls.
+        for name, app, port in (('capi', self.capi_app(), capi_port), ('inara', self.inara_app(), inara_port)):
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            self.runners.append(runner)
+            self.urls[name] = f"http://{host}:{runner.addresses[0][1]}"
+
+    async def stop(self):
+        for runner in self.runners:
+            await runner.cleanup()
+        self.runners = []
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content):
+        self.channel.ops['edit'] += 1
+        self.channel.messages[self.id] = content
+
+    async def delete(self):
+        self.channel.ops['delete'] += 1
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    # the part of a discord text channel that ChannelPages uses, counting sends, edits and deletes.
+    def __init__(self, channel_id, name):
+        self.id = channel_id
+        self.name = name
+        self.messages = {}
+        self.next_id = channel_id * 1000000
+        self.ops = {'send': 0, 'edit': 0, 'delete': 0}
+
+    async def send(self, content):
+        self.ops['send'] += 1
+        self.next_id += 1
+        self.messages[self.next_id] = content
+        return FakeMessage(self, self.next_id)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+    def __str__(self):
+        return self.name
+
+
+def load_bot(env, env_dir=None):
+    """
+    Import the stockbot package with a throwaway ENV_DIR and the given settings, without connecting to discord.
+    Settings are environment variables, so this has to happen before anything else imports stockbot.
+    """
+    os.environ.update({
+        'ENV_DIR': env_dir or tempfile.mkdtemp(prefix='stockbot-replay-'),
+        'FLEET_CARRIERS': '{}',
+        'METRICS_PORT': '0',
+        'LOG_LEVEL': 'ERROR',
+        'LOG_LEVELS': 'discord=ERROR',
+        'LOG_FILE': '',
+    })
+    os.environ.update({key: str(value) for key, value in env.items()})
+    sys.path.insert(0, REPO)
+    import stockbot.stock
+    import stockbot.wmm
+    import stockbot.workers
+    from stockbot.logs import setup_logging
+    setup_logging()
+    return stockbot
+
+
+def carrier_code(rng):
+    letters = 'ABCDEFGHJKLMNPQRSTUVWXYZ0123456789'
+    return ''.join(rng.choice(letters) for _ in range(3)) + '-' + ''.join(rng.choice(letters) for _ in range(3))
+
+
+def make_fleet(size, capi_share=0.5, stations=6, owners=50, seed=1):
+    # synthetic wmm fleet in FCDATA form: carriers spread over stations and owners, capi_share of them on cAPI.
+    rng = random.Random(seed)
+    fleet = {}
+    while len(fleet) < size:
+        fleet[carrier_code(rng)] = None
+    for i, code in enumerate(fleet):
+        fleet[code] = {'FCName': f'replay{i}', 'owner': 100000 + i % owners, 'wmm': f'Replay Station {i % stations}', 'notified': {}}
+        if rng.random() < capi_share:
+            fleet[code]['cAPI'] = True
+    return fleet
+
+
+def percentile(values, pct):
+    # nearest rank, so p99 of a handful of samples is their max.
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * pct // 100) - 1))]
+
+
+def use_fleet(stockbot, fleet):
+    # swap the bot's carriers for a fleet, with nothing cached from the last one.
+    stockbot.store.FCDATA.clear()
+    stockbot.store.FCDATA.update(json.loads(json.dumps(fleet)))
+    stockbot.store.carrier_index.rebuild(stockbot.store.FCDATA)
+    stockbot.store.carrier_list.invalidate()
+    stockbot.markets.market_cache.entries.clear()
+    stockbot.markets.market_fingerprints.entries.clear()
+    stockbot.capi.capi_client.pending.clear()
+    stockbot.channels.owner_notifier.pending.clear()
+    # every run uses the same fake channel ids, don't let it edit the messages of the last one.
+    stockbot.store.carrier_store.db.execute('DELETE FROM posted_messages')
+    for breaker in (stockbot.upstream.capi_breaker, stockbot.upstream.inara_breaker):
+        breaker.record_success()
+
+
+def age_cache(stockbot):
+    # make every cached market older than its TTL, as if a wmm interval had passed. the markets are
+    # kept as the last good ones, so unchanged responses still take the bot's unchanged market path.
+    cache = stockbot.markets.market_cache
+    for key, (fetched, timestamp, stn_data) in cache.entries.items():
+        cache.entries[key] = (fetched - max(cache.ttls.values()), timestamp, stn_data)
+
+
+def bench_worker_main(conn, index, processes):
+    # a wmm worker process that ages its own cache before every fetch, as age_cache does for the bot
+    # process before every cycle.
+    import stockbot.wmm
+    fetch_wmm_stock = stockbot.wmm.fetch_wmm_stock
+
+    async def fetch_aged(fcids):
+        age_cache(stockbot)
+        return await fetch_wmm_stock(fcids)
+    stockbot.wmm.fetch_wmm_stock = fetch_aged
+    stockbot.workers.worker_main(conn, index, processes)
+
+
+async def run_fleet(stockbot, standins, fleet, cycles, stock_samples):
+    """
+    Run `cycles` wmm updates (fetch, aggregate and render into fake channels) over a fleet, then
+    ;stock auto for up to `stock_samples` carriers with nothing cached.
+
+    :returns: report dict of timings in seconds and call counts
+    :rtype: dict
+    """
+    use_fleet(stockbot, fleet)
+    # don't time starting the worker processes.
+    stockbot.workers.worker_main = bench_worker_main
+    stockbot.workers.worker_pool.start()
+    await stockbot.workers.worker_pool.wait_ready()
+    standins.reset()
+    wmm_channel, cco_channel = FakeChannel(1, 'wmm-stock'), FakeChannel(2, 'cco-wmm-supplies')
+    wmm_pages, cco_pages = stockbot.channels.ChannelPages(wmm_channel), stockbot.channels.ChannelPages(cco_channel)
+    fcids = list(fleet)
+    cycle_times, fetch_times, render_times = [], [], []
+    failed = 0
+    for cycle in range(cycles):
+        age_cache(stockbot)
+        started = time.perf_counter()
+        results = await stockbot.wmm.fetch_wmm_stock(fcids)
+        fetched = time.perf_counter()
+        await stockbot.wmm.render_wmm(wmm_pages, cco_pages, results)
+        finished = time.perf_counter()
+        cycle_times.append(finished - started)
+        fetch_times.append(fetched - started)
+        render_times.append(finished - fetched)
+        failed += sum(1 for result in results if not result['source'])
+    cycle_calls = dict(standins.calls)
+
+    stock_times = []
+    for fcid in fcids[:stock_samples]:
+        stockbot.markets.market_cache.invalidate(fcid)
+        started = time.perf_counter()
+        await stockbot.stock.stock_command(fcid, 'auto')
+        stock_times.append(time.perf_counter() - started)
+
+    return {
+        'workers': stockbot.workers.worker_pool.processes,
+        'carriers': len(fleet),
+        'capi_carriers': sum(1 for data in fleet.values() if 'cAPI' in data),
+        'cycles': cycles,
+        'cycle_p50': percentile(cycle_times, 50),
+        'cycle_p99': percentile(cycle_times, 99),
+        'fetch_p50': percentile(fetch_times, 50),
+        'render_p50': percentile(render_times, 50),
+        'carriers_per_second': len(fleet) * cycles / sum(cycle_times),
+        'failed_fetches': failed,
+        'upstream_calls': cycle_calls,
+        'discord_ops': {op: wmm_channel.ops[op] + cco_channel.ops[op] for op in wmm_channel.ops},
+        'stock_samples': len(stock_times),
+        'stock_p50': percentile(stock_times, 50) if stock_times else None,
+        'stock_p99': percentile(stock_times, 99) if stock_times else None,
+    }
+
+
+def print_report(report):
+    calls = report['upstream_calls']
+    ops = report['discord_ops']
+    workers = f"{report['workers']} workers, " if report['workers'] else ''
+    print(f"{workers}{report['carriers']} carriers ({report['capi_carriers']} cAPI), {report['cycles']} cycles: "
+          f"cycle p50 {report['cycle_p50'] * 1000:.0f}ms p99 {report['cycle_p99'] * 1000:.0f}ms "
+          f"(fetch {report['fetch_p50'] * 1000:.0f}ms, render {report['render_p50'] * 1000:.1f}ms), "
+          f"{report['carriers_per_second']:.0f} carriers/s, {report['failed_fetches']} failed fetches")
+    print(f"    upstream: cAPI {calls['capi']} single + {calls['capi_batch']} batch ({calls['capi_batch_carriers']} carriers), "
+          f"Inara {calls['inara']} pages, {calls['capi_errors'] + calls['inara_errors']} injected errors; "
+          f"discord: {ops['send']} sent, {ops['edit']} edited, {ops['delete']} deleted")
+    if report['stock_samples']:
+        print(f"    ;stock auto, nothing cached: p50 {report['stock_p50'] * 1000:.0f}ms p99 {report['stock_p99'] * 1000:.0f}ms "
+              f"over {report['stock_samples']} carriers")
+
+
+async def bench(args):
+    standins = StandIns(Corpus(args.corpus), args.latency, args.jitter, args.error_rate, args.churn, batch=not args.no_batch, seed=args.seed)
+    await standins.start()
+    sizes = [int(size) for size in args.fleet.split(',')]
+    stockbot = load_bot({
+        'API_HOST': standins.urls['capi'],
+        'API_TOKEN': 'replay',
+        'INARA_URL': standins.urls['inara'],
+        'CAPI_RATE': args.capi_rate,
+        'INARA_RATE': args.inara_rate,
+        'WMM_CONCURRENCY': args.concurrency,
+        'MARKET_CACHE_SIZE': 2 * max(sizes) + 10,
+    })
+    print(f"corpus: {len(standins.corpus)} recorded responses, latency {args.latency}s+{args.jitter}s, "
+          f"error rate {args.error_rate}, churn {args.churn}, concurrency {args.concurrency}")
+    reports = []
+    worker_pool = stockbot.workers.worker_pool
+    try:
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            for size in sizes:
+                worker_pool.processes = workers
+                report = await run_fleet(stockbot, standins, make_fleet(size, args.capi_share, seed=args.seed), args.cycles, args.stock_samples)
+                # the next fleet starts with new workers, with nothing cached.
+                await worker_pool.stop()
+                print_report(report)
+                reports.append(report)
+    finally:
+        await worker_pool.stop()
+        await standins.stop()
+        if stockbot.upstream.http_session is not None:
+            await stockbot.upstream.http_session.close()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+def best_of(fn, repeat=5, number=1):
+    # fastest time per call over `repeat` runs of `number` calls.
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = (time.perf_counter() - started) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def micro(args):
+    # the single threaded hot spots of a wmm update and ;stock, outside of any i/o.
+    stockbot = load_bot({})
+    corpus = Corpus(args.corpus)
+    fleet = make_fleet(args.carriers, seed=args.seed)
+
+    pages = [corpus.inara(fcid) for fcid in list(fleet)[:20]]
+    fast = best_of(lambda: [stockbot.inara.parse_inara_market_fast('REPLAY', page) for page in pages]) / len(pages)
+    soup = best_of(lambda: [stockbot.inara.parse_inara_market_soup('REPLAY', page) for page in pages], repeat=2) / len(pages)
+    print(f"inara parser: {1 / fast:.0f} pages/s, BeautifulSoup fallback {1 / soup:.0f} pages/s ({soup / fast:.0f}x)")
+
+    markets = [stockbot.inara.parse_inara_market_fast(fcid, corpus.inara(fcid)) for fcid in list(fleet)[:20]]
+    tables = [[(com['name'], com['stock'], com['demand']) for com in market['commodities'] if com['stock'] or com['demand']] for market in markets]
+    formatter = best_of(lambda: [stockbot.stock.format_stock_table(rows) for rows in tables], number=10) / len(tables)
+    line = f"stock table: {formatter * 1e6:.0f}us per table"
+    try:
+        from texttable import Texttable
+
+        def texttable(rows):
+            table = Texttable()
+            table.set_cols_align(["l", "r", "r"])
+            table.set_cols_valign(["m", "m", "m"])
+            table.set_cols_dtype(['t', 'i', 'i'])
+            table.set_deco(Texttable.HEADER)
+            table.header(["Commodity", "Amount", "Demand"])
+            table.add_rows(rows, header=False)
+            return table.draw()
+        reference = best_of(lambda: [texttable(rows) for rows in tables]) / len(tables)
+        same = all(texttable(rows) == stockbot.stock.format_stock_table(rows) for rows in tables)
+        line += f", Texttable {reference * 1e6:.0f}us ({reference / formatter:.0f}x, output {'identical' if same else 'DIFFERENT'})"
+    except ImportError:
+        line += " (install texttable to compare)"
+    print(line)
+
+    # a day of hourly snapshots per carrier, with stock running down since a restock half a day ago.
+    use_fleet(stockbot, fleet)
+    standins = StandIns(corpus, seed=args.seed)
+    now = time.time()
+    results = []
+    for fcid in fleet:
+        status, market = standins.capi_market(fcid)
+        commodities = market['market']['commodities']
+        for hour in range(24, -1, -1):
+            for com in commodities:
+                com['stock'] = max(0, com['stock'] - 50) if hour < 12 else com['stock'] + 50
+            stockbot.markets.market_snapshots.record(fcid, 'capi', [dict(com) for com in commodities], fetched=now - hour * 3600)
+        results.append({'fcid': fcid, 'source': 'capi' if 'cAPI' in fleet[fcid] else 'inara', 'status': None, 'reauth': False,
+                        'data': {'currentStarSystem': market['currentStarSystem'], 'full_name': fcid, 'commodities': commodities,
+                                 'market_updated': 'just now (18 Oct 2026, 3:05pm)'}})
+    wmm_ids = [stockbot.markets.market_snapshots.intern(commodity) for commodity in stockbot.wmm.WMM_COMMODITIES]
+    fcids = list(fleet)
+    forecast = best_of(lambda: stockbot.markets.market_snapshots.forecast(fcids, wmm_ids, stockbot.config.WMM_FORECAST_HOURS * 3600, now=now))
+    print(f"forecast: {forecast * 1000:.1f}ms for {len(fcids)} carriers x {len(wmm_ids)} commodities")
+    forecasts = stockbot.markets.market_snapshots.forecast(fcids, wmm_ids, stockbot.config.WMM_FORECAST_HOURS * 3600, now=now)
+    aggregate = best_of(lambda: stockbot.wmm.aggregate_wmm(results, forecasts), number=10)
+    print(f"aggregate_wmm: {aggregate * 1000:.2f}ms for {len(results)} carriers")
+
+    # 90 days of hourly stock changes of the wmm commodities, as the market history database would hold them.
+    days = 90
+    carriers = fcids[:100]
+    with tempfile.TemporaryDirectory() as directory:
+        history = stockbot.history.MarketHistory(os.path.join(directory, 'history.db'))
+        started = time.perf_counter()
+        for fcid in carriers:
+            history.write([(fcid, commodity, int(now - hour * 3600), (hour * 37) % 25000, 0, 5000, 0, 37 if hour % 675 else 0, int(not hour % 675))
+                           for commodity in stockbot.wmm.WMM_COMMODITIES for hour in range(days * 24, -1, -1)])
+        rows = len(carriers) * len(stockbot.wmm.WMM_COMMODITIES) * (days * 24 + 1)
+        print(f"history: {rows} rows written in {time.perf_counter() - started:.1f}s")
+        single = best_of(lambda: history.select_series(carriers[:1], ['indite'], now - days * 86400, now))
+        print(f"history query: {single * 1000:.1f}ms for one carrier and commodity over {days} days")
+        for report_days in (7, days):
+            report = best_of(lambda: history.select_changes(carriers, stockbot.wmm.WMM_COMMODITIES, now - report_days * 86400, now))
+            print(f"wmm_report query: {report * 1000:.1f}ms for {len(carriers)} carriers over {report_days} days")
+        started = time.perf_counter()
+        history.compact(now)
+        print(f"history compaction: {time.perf_counter() - started:.1f}s")
+
+
+async def serve(args):
+    standins = StandIns(Corpus(args.corpus), args.latency, args.jitter, args.error_rate, args.churn, batch=not args.no_batch, seed=args.seed)
+    await standins.start(args.host, args.capi_port, args.inara_port)
+    print(f"API_HOST={standins.urls['capi']} INARA_URL={standins.urls['inara']} ({len(standins.corpus)} recorded responses)")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            print(json.dumps(standins.calls))
+    finally:
+        await standins.stop()
+
+
+async def record(args):
+    api_host = os.getenv('API_HOST')
+    api_token = os.getenv('API_TOKEN')
+    if args.carriers:
+        carriers = {code.strip().upper(): True for code in args.carriers.split(',')}
+    else:
+        db = sqlite3.connect(os.path.join(args.env_dir, 'carriers.db'))
+        carriers = {code: 'cAPI' in json.loads(data) for code, data in db.execute('SELECT code, data FROM carriers')}
+    for upstream in ('capi', 'inara'):
+        os.makedirs(os.path.join(args.out, upstream), exist_ok=True)
+    async with aiohttp.ClientSession(headers={'User-Agent': 'PTNStockBot'}, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        for code, capi in carriers.items():
+            if capi and api_host:
+                async with session.get(f"{api_host}/capi/{code}", params={'token': api_token}) as r:
+                    try:
+                        data = await r.json(content_type=None)
+                    except ValueError:
+                        data = await r.text()
+                    with open(os.path.join(args.out, 'capi', f"{code}.json"), 'w') as f:
+                        json.dump({'status': r.status, 'data': data}, f)
+                    print(f"{code}: cAPI {r.status}")
+            async with session.get(f"{args.inara_url}/elite/station-market/", params={'search': code}) as r:
+                if r.status == 200:
+                    with open(os.path.join(args.out, 'inara', f"{code}.html"), 'wb') as f:
+                        f.write(await r.read())
+                print(f"{code}: Inara {r.status}")
+            await asyncio.sleep(1 / args.inara_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recorder = commands.add_parser('record', help='record cAPI and Inara responses into a corpus')
+    recorder.add_argument('--out', default='corpus')
+    recorder.add_argument('--carriers', help='comma separated carrier ids, default: every carrier in --env-dir')
+    recorder.add_argument('--env-dir', default=os.getenv('ENV_DIR', ''), help="the bot's ENV_DIR, for its carriers.db")
+    recorder.add_argument('--inara-url', default='https://inara.cz')
+    recorder.add_argument('--inara-rate', type=float, default=1, help='Inara pages per second')
+
+    for name, help in (('serve', 'run the stand-in servers'), ('bench', 'replay wmm cycles over synthetic fleets')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--corpus', help='recorded corpus directory, default: synthetic markets')
+        command.add_argument('--latency', type=float, default=0.05, help='seconds before each stand-in response')
+        command.add_argument('--jitter', type=float, default=0.0, help='up to this many extra seconds per response')
+        command.add_argument('--error-rate', type=float, default=0.0, help='fraction of responses that are errors')
+        command.add_argument('--churn', type=float, default=0.2, help='fraction of responses with a changed market')
+        command.add_argument('--no-batch', action='store_true', help='serve without the /capi/batch endpoint')
+        command.add_argument('--seed', type=int, default=1)
+    server = commands.choices['serve']
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--capi-port', type=int, default=8081)
+    server.add_argument('--inara-port', type=int, default=8082)
+    bencher = commands.choices['bench']
+    bencher.add_argument('--fleet', default='10,100,1000', help='comma separated fleet sizes')
+    bencher.add_argument('--cycles', type=int, default=5)
+    bencher.add_argument('--capi-share', type=float, default=0.5, help='fraction of the fleet on cAPI')
+    bencher.add_argument('--concurrency', type=int, default=10, help='WMM_CONCURRENCY')
+    bencher.add_argument('--workers', default='0', help='comma separated WMM_WORKERS to compare, 0 fetches in the bot process')
+    bencher.add_argument('--capi-rate', type=float, default=0, help='CAPI_RATE, 0 for unlimited')
+    bencher.add_argument('--inara-rate', type=float, default=0, help='INARA_RATE, 0 for unlimited')
+    bencher.add_argument('--stock-samples', type=int, default=50, help='carriers to time ;stock auto for')
+    bencher.add_argument('--json', help='also write the reports to this file')
+
+    microbench = commands.add_parser('micro', help='time the parser, stock table, forecast, aggregation and history queries')
+    microbench.add_argument('--corpus')
+    microbench.add_argument('--carriers', type=int, default=500)
+    microbench.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'micro':
+        micro(args)
+    else:
+        asyncio.run({'record': record, 'serve': serve, 'bench': bench}[args.command](args))
+
+
+if __name__ == '__main__':
+    main()